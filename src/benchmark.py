@@ -0,0 +1,131 @@
+import argparse
+import importlib
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from frame_source import Intrinsics, SyntheticSource, scale_intrinsics
+from instrument import StageTimer
+
+# Per-stage benchmark of the detectors. Every detector runs on the same fixed synthetic scenes(seeded) at several resolutions and clutter
+# levels with the drawing enabled, as in the scripts, and the time of every stage(see the lap() calls of each detect()) is reported as p50/p99.
+# A second, shorter run traces the allocations of every stage with tracemalloc. The results are saved as JSON; --compare checks them against
+# a saved baseline and exits with status 1 if a stage got slower than the tolerance allows.
+#
+#   python benchmark.py --out baseline.json
+#   python benchmark.py --compare baseline.json
+
+RESOLUTIONS = ((640, 480), (848, 480), (1280, 720))
+CLUTTER = (0, 4)
+
+
+# Renders the fixed scenes of one case once, so that rendering is not part of the measurement
+def render(intrinsics, clutter, frames, seed):
+    return list(SyntheticSource(intrinsics, num_frames=frames, clutter=clutter, seed=seed))
+
+
+# Times one detector on the frames: the per stage summary of the StageTimer plus a 'total' stage(the whole detect() call)
+def bench(module, intrinsics, frames, repeat, warmup, options):
+    timer = StageTimer()
+    detector = module.Detector(intrinsics, timer=timer, **options)
+    total = []
+    for i in range(warmup + repeat * len(frames)):
+        if i == warmup:
+            timer.reset()
+        frame = frames[i % len(frames)]
+        t = time.perf_counter()
+        detector.detect(frame, draw=True)
+        if i >= warmup:
+            total.append(time.perf_counter() - t)
+    stats = timer.summary()
+    us = np.array(total) * 1e6
+    stats['total'] = dict(count=len(us), mean_us=float(us.mean()), p50_us=float(np.percentile(us, 50)), p99_us=float(np.percentile(us, 99)))
+
+    # Allocations, traced on one pass over the frames
+    timer = StageTimer(trace_allocations=True)
+    detector = module.Detector(intrinsics, timer=timer, **options)
+    detector.detect(frames[0], draw=True)
+    timer.reset()
+    tracemalloc.start()
+    try:
+        for frame in frames:
+            detector.detect(frame, draw=True)
+    finally:
+        tracemalloc.stop()
+    for name, traced in timer.summary().items():
+        stats.setdefault(name, {}).update(alloc_p50=traced.get('alloc_p50', 0), alloc_max=traced.get('alloc_max', 0))
+    return stats
+
+
+def run(detectors, resolutions, clutter_levels, frames, repeat, warmup, seed, options):
+    results = []
+    for name in detectors:
+        module = importlib.import_module(name)
+        for width, height in resolutions:
+            intrinsics = scale_intrinsics(Intrinsics(640, 480, module.fx, module.fy, module.cx, module.cy), width, height)
+            for clutter in clutter_levels:
+                stats = bench(module, intrinsics, render(intrinsics, clutter, frames, seed), repeat, warmup, options)
+                for stage, values in stats.items():
+                    results.append(dict(detector=name, resolution='%dx%d' % (width, height), clutter=clutter, stage=stage, **values))
+                print('%s %dx%d clutter=%d total p50=%.0fus p99=%.0fus' % (name, width, height, clutter, stats['total']['p50_us'], stats['total']['p99_us']))
+    return results
+
+
+def environment():
+    return dict(python=platform.python_version(), numpy=np.__version__, opencv=cv2.__version__, machine=platform.machine(),
+                processor=platform.processor(), platform=platform.platform())
+
+
+def key(result):
+    return result['detector'], result['resolution'], result['clutter'], result['stage']
+
+
+# Prints the stages whose p50 got slower than tolerance(a ratio, 0.2 is 20%) compared to the baseline, returns their number. Stages faster
+# than min_us in both runs are skipped, their timing is mostly noise
+def compare(results, baseline, tolerance=0.2, min_us=20):
+    previous = {key(result): result for result in baseline}
+    regressions = 0
+    for result in results:
+        before = previous.get(key(result))
+        if before is None or max(before['p50_us'], result['p50_us']) < min_us:
+            continue
+        ratio = result['p50_us'] / before['p50_us'] if before['p50_us'] > 0 else float('inf')
+        slower = ratio > 1 + tolerance
+        regressions += slower
+        print('%-6s %-9s clutter=%d %-13s p50 %8.0fus -> %8.0fus (x%.2f)%s' % (key(result) + (before['p50_us'], result['p50_us'], ratio, '  REGRESSION' if slower else '')))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--detectors', nargs='*', default=['test1', 'test2', 'test3'])
+    parser.add_argument('--resolutions', nargs='*', default=['%dx%d' % r for r in RESOLUTIONS])
+    parser.add_argument('--clutter', nargs='*', type=int, default=list(CLUTTER))
+    parser.add_argument('--frames', type=int, default=20, help='number of distinct scenes per case')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed passes over the scenes')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pyramid', type=int, default=0, help='benchmark the coarse-to-fine search with this factor')
+    parser.add_argument('--out', default=None, help='save the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='JSON file of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slow down of a stage before it is reported as a regression')
+    args = parser.parse_args()
+
+    resolutions = [tuple(int(v) for v in r.split('x')) for r in args.resolutions]
+    options = dict(pyramid=args.pyramid) if args.pyramid else {}
+    results = run(args.detectors, resolutions, args.clutter, args.frames, args.repeat, args.warmup, args.seed, options)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(dict(environment=environment(), options=vars(args), results=results), f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['environment'] != environment():
+            print('Warning: the baseline was measured on another environment', baseline['environment'])
+        sys.exit(1 if compare(results, baseline['results'], args.tolerance) else 0)
@@ -0,0 +1,111 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+from frame_source import Intrinsics
+from geometry import region_distance
+
+# Calibration of the pixel size of the ROI/drone against distance. A marker of the drone's size is moved in front of the camera; on every
+# frame it is found by color, its bounding rectangle and its distance are sampled, and w_px = a/z + b(h_px likewise) is fitted over all the
+# distances seen. The fit is saved as JSON, which the detectors load(--calibration) in place of the pixel sizes hardcoded in the scripts
+# (test1: the ROI is the drone 1 m away, test2/test3: the drone 2 m away).
+#
+# The marker is thresholded in HSV(cv2.cvtColor + cv2.inRange) only within a window around the marker of the previous frame.
+
+
+class Calibrator:
+    # Collects (distance, width, height) samples of the marker, the median of each distance bin(bin meters wide) being kept so that lingering
+    # at one distance does not outweigh the others. The search window is the marker of the previous frame grown by margin times its size on
+    # every side, the whole frame when the marker was lost. A marker touching the border of the image is not sampled, it may be cut
+    def __init__(self, lower, upper, intrinsics, bin=0.05, margin=0.5, min_area=100):
+        self.lower = lower # HSV bounds of the marker's color, inclusive as in cv2.inRange
+        self.upper = upper
+        self.intrinsics = intrinsics
+        self.bin = bin
+        self.margin = margin
+        self.min_area = min_area
+        self.window = None
+        self.samples = {} # distance bin -> list of (distance, width, height)
+
+    def search_window(self, shape):
+        if self.window is None:
+            return 0, 0, shape[1], shape[0]
+        x, y, w, h = self.window
+        dx, dy = int(w * self.margin) + 8, int(h * self.margin) + 8
+        x1, y1 = max(x - dx, 0), max(y - dy, 0)
+        return x1, y1, min(x + w + dx, shape[1]) - x1, min(y + h + dy, shape[0]) - y1
+
+    # Finds the marker in the frame and samples it. Returns its bounding rectangle(None if it was not found) and the mask of the search window
+    def add(self, frame):
+        image = frame.color_image
+        x, y, w, h = self.search_window(image.shape)
+        mask = cv2.inRange(cv2.cvtColor(image[y:y + h, x:x + w], cv2.COLOR_BGR2HSV), self.lower, self.upper)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x, y))
+        marker = max(contours, key=cv2.contourArea, default=None)
+        if marker is None or cv2.contourArea(marker) < self.min_area:
+            self.window = None
+            return None, mask
+        rect = cv2.boundingRect(marker)
+        self.window = rect
+
+        mx, my, mw, mh = rect
+        H, W = image.shape[:2]
+        if mx > 0 and my > 0 and mx + mw < W and my + mh < H:
+            distance = region_distance(frame.depth_image, rect, frame.depth_scale)
+            if distance > 0:
+                self.samples.setdefault(int(distance / self.bin), []).append((distance, mw, mh))
+        return rect, mask
+
+    # (distance, width, height) per distance bin, sorted by distance
+    def binned(self):
+        binned = np.array([np.median(samples, axis=0) for samples in self.samples.values()]).reshape(-1, 3)
+        return binned[np.argsort(binned[:, 0])]
+
+    # Fits width and height against distance over the bins, returns the calibration(see save_calibration), None with less than 2 distances
+    def fit(self):
+        samples = self.binned()
+        if len(samples) < 2:
+            return None
+        A = np.column_stack([1 / samples[:, 0], np.ones(len(samples))])
+        fits, rms = [], []
+        for column in (1, 2):
+            coeffs = np.linalg.lstsq(A, samples[:, column], rcond=None)[0]
+            fits.append(coeffs)
+            rms.append(float(np.sqrt(np.mean((A @ coeffs - samples[:, column])**2))))
+        return dict(intrinsics=self.intrinsics._asdict(), width=[float(v) for v in fits[0]], height=[float(v) for v in fits[1]], rms=rms,
+                    samples=samples.tolist())
+
+
+def save_calibration(path, calibration):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(calibration, f, indent=1)
+    os.replace(tmp, path)
+
+
+def load_calibration(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Pixel size (w, h) of the calibration marker at distance meters for a stream with the given intrinsics. At the resolution of the calibration
+# the fit is returned as it is; the calibration may also have been done at another resolution, the size is then scaled by the ratio of the
+# focal lengths. intrinsics must be the ones the stream reports(as saved by the Calibrator), not the constants of the scripts
+def calibrated_size(calibration, distance, intrinsics):
+    calibrated = Intrinsics(**calibration['intrinsics'])
+    (aw, bw), (ah, bh) = calibration['width'], calibration['height']
+    width, height = aw / distance + bw, ah / distance + bh
+    if (intrinsics.width, intrinsics.height) == (calibrated.width, calibrated.height):
+        return width, height
+    return width * intrinsics.fx / calibrated.fx, height * intrinsics.fy / calibrated.fy
+
+
+def add_calibration_arguments(parser):
+    parser.add_argument('--calibration', default=None, help='calibration file written by find_roi_dims_based_on_color.py --calibrate, replaces the hardcoded pixel sizes of the drone')
+    return parser
+
+
+def open_calibration(args):
+    return load_calibration(args.calibration) if args.calibration else None
@@ -0,0 +1,163 @@
+import json
+import math
+import socket
+import threading
+import time
+from collections import deque, namedtuple
+from enum import Enum
+
+
+class Action(Enum):
+    FREE_SPACE = 'free_space' # nothing in front of the drone within the ROI
+    PASS = 'pass' # the gap is big enough for the drone
+    MORPH = 'morph' # the gap is aligned but smaller than the drone
+    CANNOT_PASS = 'cannot_pass'
+    TURN_LEFT = 'turn_left'
+    TURN_RIGHT = 'turn_right'
+    TURN_UP = 'turn_up'
+    TURN_DOWN = 'turn_down'
+    NO_GAP = 'no_gap' # no gap found in the frame
+    UNDECIDED = 'undecided' # a gap was found but none of the conditions applies
+
+
+# What a detector decided for one frame:
+# - rect: (x, y, w, h) of the gap in the image, None if there is no gap
+# - size: (width, height) of the gap in meters, None if it could not be measured
+# - confidence: fraction of the gap rectangle which is actually free(0..1)
+# - frame_id, timestamp: frame number and camera timestamp(ms) of the frame the decision was taken on
+# - latency: seconds from the reception of the frame to the decision
+# - planes: what a multi-plane sweep found at every distance plane(list of sweep.PlaneGap), None if no sweep was run
+# - corridor: free length of the drone's corridor in the voxel map(voxmap.Corridor), None if no map is kept
+# - morph: smallest morph fitting each candidate gap of the frame(list of morph.MorphFit, the gap of rect first), None if not solved
+# - reason: why size is incomplete(e.g. an edge of the gap without valid depth, see geometry.missing_reason), None if it is not
+# - plane: (normal, residual) of the plane fitted on the border of the gap, its orientation and how far from planar it is(see
+#   geometry.GapSize), None if there is no gap
+Decision = namedtuple('Decision', ['action', 'rect', 'size', 'confidence', 'frame_id', 'timestamp', 'latency', 'planes', 'corridor', 'morph',
+                                   'reason', 'plane'], defaults=(None, None, None, None, None))
+
+
+def make_decision(frame, action, rect=None, size=None, confidence=0.0, planes=None, corridor=None, morph=None, reason=None, plane=None):
+    return Decision(action, rect, size, confidence, frame.frame_number, frame.timestamp, time.perf_counter() - frame.received_at, planes,
+                    corridor, morph, reason, plane)
+
+
+# Plain JSON-able dict of a decision(nan becomes None)
+def to_dict(decision):
+    def clean(value):
+        if isinstance(value, Enum):
+            return value.value
+        if hasattr(value, '_asdict'): # nested records
+            return {name: clean(v) for name, v in value._asdict().items()}
+        if isinstance(value, (tuple, list)):
+            return [clean(v) for v in value]
+        if hasattr(value, 'item'): # numpy scalars
+            value = value.item()
+        if isinstance(value, float) and math.isnan(value):
+            return None
+        return value
+    return {name: clean(value) for name, value in decision._asdict().items()}
+
+
+class DecisionSink:
+    # Non-blocking output of the decisions. put() only appends to a bounded buffer(the oldest records are dropped if the writer falls behind),
+    # a background thread writes them in batches. Records are rate limited: a record is kept if the action changed or if at least
+    # min_interval seconds passed since the last kept one
+    def __init__(self, min_interval=0.0, batch_size=32, flush_interval=0.05, maxlen=1024):
+        self.min_interval = min_interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = deque(maxlen=maxlen)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.last_action = None
+        self.last_time = -math.inf
+        self.thread = threading.Thread(target=self.loop, name='decision-sink', daemon=True)
+        self.thread.start()
+
+    def put(self, decision):
+        now = time.monotonic()
+        if decision.action == self.last_action and now - self.last_time < self.min_interval:
+            return
+        self.last_action, self.last_time = decision.action, now
+        with self.cond:
+            self.buffer.append(decision)
+            if len(self.buffer) >= self.batch_size:
+                self.cond.notify()
+
+    # Consumer for the pipeline, whose processing returns (decision, images)
+    def consume(self, stamped):
+        self.put(stamped.output[0])
+
+    def loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.closed or len(self.buffer) >= self.batch_size, self.flush_interval)
+                batch = list(self.buffer)
+                self.buffer.clear()
+                closed = self.closed
+            if batch:
+                self.write([to_dict(decision) for decision in batch])
+            if closed:
+                break
+
+    def write(self, records):
+        raise NotImplementedError
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+
+class FileSink(DecisionSink):
+    # Appends the decisions to a file, one JSON record per line
+    def __init__(self, path, **kwargs):
+        self.file = open(path, 'a')
+        super().__init__(**kwargs)
+
+    def write(self, records):
+        self.file.write(''.join(json.dumps(record) + '\n' for record in records))
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class UdpSink(DecisionSink):
+    # Sends every batch of decisions as one UDP datagram(JSON lines) to a local port, e.g. the bridge to the flight controller
+    def __init__(self, host='127.0.0.1', port=14600, **kwargs):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        super().__init__(**kwargs)
+
+    def write(self, records):
+        try:
+            self.sock.sendto(''.join(json.dumps(record) + '\n' for record in records).encode(), self.address)
+        except OSError:
+            pass # nobody listening, the decisions are dropped rather than blocking the pipeline
+
+    def close(self):
+        super().close()
+        self.sock.close()
+
+
+def add_decision_arguments(parser):
+    parser.add_argument('--headless', action='store_true', help='no drawing, no windows and no printing, only the decision records go to the sink')
+    parser.add_argument('--sink', default=None, help="where the decision records go: 'file:<path>' or 'udp:<host>:<port>'")
+    parser.add_argument('--max-rate', type=float, default=0.0, help='max records per second while the decision does not change(0 = every frame)')
+    return parser
+
+
+def open_sink(args):
+    if args.sink is None:
+        return None
+    kind, _, target = args.sink.partition(':')
+    min_interval = 1.0 / args.max_rate if args.max_rate > 0 else 0.0
+    if kind == 'file':
+        return FileSink(target, min_interval=min_interval)
+    if kind == 'udp':
+        host, _, port = target.rpartition(':')
+        return UdpSink(host or '127.0.0.1', int(port), min_interval=min_interval)
+    raise ValueError('Unknown decision sink: ' + args.sink)
@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+
+# Labels of the depth bands
+INVALID = 0 # no depth measured(z16 value 0)
+NEAR = 1 # closer than the near threshold(foreground)
+UNCERTAIN = 2 # between the near and the far threshold
+FAR = 3 # farther than the far threshold(background)
+
+
+# Depth image with its isolated invalid pixels filled: the holes no 3x3 square fits in(the pixels the D455 drops here and there) take the
+# closest valid depth around them, so that they no longer cut the free regions into slivers while a hole touching an obstacle becomes part
+# of it. Larger invalid regions are left at 0. Returns depth_image itself if it has no isolated hole
+def fill_speckles(depth_image):
+    holes = cv2.compare(depth_image, 0, cv2.CMP_EQ)
+    kernel = np.ones((3, 3), np.uint8)
+    speckles = cv2.subtract(holes, cv2.morphologyEx(holes, cv2.MORPH_OPEN, kernel))
+    if not cv2.countNonZero(speckles):
+        return depth_image
+    # Erosion takes the minimum of the neighbourhood, 0 - 1 wraps around to the maximum depth so that holes never win(and 0 comes back)
+    closest = cv2.erode(depth_image - np.uint16(1), kernel) + np.uint16(1)
+    filled = depth_image.copy()
+    np.copyto(filled, closest, where=speckles.view(bool))
+    return filled
+
+
+# Lookup table from every possible z16 value to its band label, so that classifying a depth image is a single gather over the buffer
+def band_lut(near_threshold, far_threshold):
+    lut = np.full(65536, UNCERTAIN, dtype=np.uint8)
+    lut[1:int(near_threshold)] = NEAR
+    lut[int(far_threshold) + 1:] = FAR
+    lut[0] = INVALID
+    return lut
+
+
+class DepthBandClassifier:
+    # Classifies the depth pixels within roi = (x1, y1, x2, y2) into INVALID/NEAR/UNCERTAIN/FAR. Thresholds are in depth units(mm for the
+    # D455). The lookup table and the label buffer are allocated once and reused for every frame
+    def __init__(self, near_threshold, far_threshold, roi):
+        self.near_threshold = near_threshold
+        self.far_threshold = far_threshold
+        self.roi = roi
+        self.lut = band_lut(near_threshold, far_threshold)
+        x1, y1, x2, y2 = roi
+        self.labels = np.empty((y2 - y1, x2 - x1), dtype=np.uint8)
+
+    def classify(self, depth_image):
+        x1, y1, x2, y2 = self.roi
+        np.take(self.lut, depth_image[y1:y2, x1:x2], out=self.labels)
+        return DepthBands(self.labels, self.roi, depth_image)
+
+
+class DepthBands:
+    # Result of the classification. Only the label map is computed upfront, masks and images are derived from it when they are asked for
+    def __init__(self, labels, roi, depth_image):
+        self.labels = labels # uint8 label map of the ROI
+        self.roi = roi
+        self.depth_image = depth_image
+        self.masks = {}
+
+    # Binary mask(0/255) of the ROI pixels with the given label, same size as the ROI
+    def mask(self, label):
+        if label not in self.masks:
+            self.masks[label] = cv2.compare(self.labels, label, cv2.CMP_EQ)
+        return self.masks[label]
+
+    # Binary mask of the given label over the full image(0 outside the ROI)
+    def full_mask(self, label):
+        x1, y1, x2, y2 = self.roi
+        mask = np.zeros(self.depth_image.shape, dtype=np.uint8)
+        mask[y1:y2, x1:x2] = self.mask(label)
+        return mask
+
+    # Color image showing only the ROI pixels with the given label, the rest set to 0(what the scripts used to build with roi_image and bitwise_and)
+    def masked_color(self, color_image, label=FAR):
+        x1, y1, x2, y2 = self.roi
+        image = np.zeros_like(color_image)
+        cv2.copyTo(color_image[y1:y2, x1:x2], self.mask(label), image[y1:y2, x1:x2])
+        return image
+
+    # Colorized depth image for visualization
+    def colormap(self):
+        return cv2.applyColorMap(cv2.convertScaleAbs(self.depth_image, alpha=0.03), cv2.COLORMAP_HSV)
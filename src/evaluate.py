@@ -0,0 +1,208 @@
+import argparse
+import ast
+import importlib
+import inspect
+import itertools
+import json
+import math
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+from decision import Action
+from frame_source import Frame, Intrinsics, SyntheticSource, scale_intrinsics
+from recording import Recording, is_recording
+
+# Offline evaluation of the detectors(test1, test2, test3) over a grid of parameters. The frames(synthetic scenes, which carry the ground
+# truth of their gap, or a recording of them) are loaded once into shared memory and every worker of a process pool maps the same depth
+# images, a job being one configuration run over a contiguous block of frames. Every configuration gets the accuracy of its pass/don't pass
+# decisions against the labelled gap sizes, the errors of the measured gap sizes and the latency of the detection.
+#
+#   python evaluate.py --detector test2 --frames 600 --grid far_threshold=1900,2100,2500 tol=30,50,80 --workers 4 --out results.json
+#
+# A grid parameter is either an argument of the Detector(pyramid, score, track...) or a module constant of the detector script(roi_im_b,
+# roi_im_h, tol, tol_to_align_centers, near_threshold, far_threshold...), which is replaced before the Detector is built.
+
+# Actions counted as "the drone goes forward through the gap"
+PASS_ACTIONS = (Action.PASS, Action.FREE_SPACE)
+
+
+# Loads count frames into one shared memory block: returns the block, the depth images stacked in it and the per frame metadata
+# (timestamp, frame number, depth scale, ground truth). The frames are copied one at a time, they are never all held in memory
+def share_frames(frames, count):
+    block = depth = None
+    meta = []
+    for i, frame in enumerate(itertools.islice(frames, count)):
+        if block is None:
+            shape = (count,) + frame.depth_image.shape
+            block = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 2)
+            depth = np.ndarray(shape, np.uint16, buffer=block.buf)
+        depth[i] = frame.depth_image
+        meta.append((frame.timestamp, frame.frame_number, frame.depth_scale, frame.gap))
+    return block, depth[:len(meta)], meta
+
+
+# State of a worker process: the shared depth images, the frame metadata and the original values of the module constants it replaced
+worker = {}
+
+
+def init_worker(name, shape, meta):
+    block = shared_memory.SharedMemory(name=name)
+    worker['block'] = block # kept referenced so that the mapping stays valid
+    worker['depth'] = np.ndarray(shape, np.uint16, buffer=block.buf)
+    worker['meta'] = meta
+    worker['defaults'] = {}
+
+
+# Replaces the module constants given in params, after putting back the ones a previous job replaced
+def configure(module, params):
+    defaults = worker.setdefault('defaults', {})
+    for (module_name, name), value in defaults.items():
+        setattr(importlib.import_module(module_name), name, value)
+    defaults.clear()
+    for name, value in params.items():
+        if not hasattr(module, name):
+            raise AttributeError('%s has no parameter %s' % (module.__name__, name))
+        defaults[(module.__name__, name)] = getattr(module, name)
+        setattr(module, name, value)
+
+
+# Runs one configuration over frames start..stop-1, returns one (action, rect, size, latency) per frame
+def run_job(job):
+    detector_name, intrinsics, params, start, stop = job
+    module = importlib.import_module(detector_name)
+    arguments = inspect.signature(module.Detector).parameters
+    configure(module, {name: value for name, value in params.items() if name not in arguments})
+    detector = module.Detector(intrinsics, **{name: value for name, value in params.items() if name in arguments})
+
+    results = []
+    for i in range(start, stop):
+        timestamp, frame_number, depth_scale, gap = worker['meta'][i]
+        frame = Frame(worker['depth'][i], None, timestamp, frame_number, depth_scale, gap)
+        t = time.perf_counter()
+        decision, _ = detector.detect(frame)
+        results.append((decision.action, decision.rect, decision.size, time.perf_counter() - t))
+    return results
+
+
+def iou(a, b):
+    if a is None or b is None:
+        return 0.0
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = max(min(ax + aw, bx + bw) - max(ax, bx), 0)
+    h = max(min(ay + ah, by + bh) - max(ay, by), 0)
+    union = aw * ah + bw * bh - w * h
+    return w * h / union if union > 0 else 0.0
+
+
+# Scores the decisions of one configuration against the ground truth of the frames. A gap is passable if it exists and is wider and higher
+# than the drone(drone_width, drone_height of the detector script). A gap is detected if the decision rectangle overlaps the true one with an
+# intersection over union of at least 0.5, the size errors are taken over the detected gaps
+def score(results, meta, drone_width, drone_height):
+    correct = false_pass = missed_pass = detected = labelled = 0
+    width_errors, height_errors = [], []
+    for (action, rect, size, _), (_, _, _, gap) in zip(results, meta):
+        if gap is None:
+            continue
+        labelled += 1
+        passable = gap.kind != 'wall' and gap.width > drone_width and gap.height > drone_height
+        passes = action in PASS_ACTIONS
+        correct += passes == passable
+        false_pass += passes and not passable
+        missed_pass += passable and not passes
+        if gap.rect is not None and iou(rect, gap.rect) >= 0.5:
+            detected += 1
+            if size is not None and not math.isnan(size[0]):
+                width_errors.append(abs(size[0] - gap.width))
+                height_errors.append(abs(size[1] - gap.height))
+
+    latency = np.array([r[3] for r in results]) * 1000
+    return dict(
+        frames=len(results),
+        accuracy=correct / labelled if labelled else None,
+        false_pass_rate=false_pass / labelled if labelled else None, # the drone would fly into something, the costly error
+        missed_pass_rate=missed_pass / labelled if labelled else None,
+        detection_rate=detected / labelled if labelled else None,
+        width_error=float(np.median(width_errors)) if width_errors else None, # median absolute error in meters
+        height_error=float(np.median(height_errors)) if height_errors else None,
+        latency_p50=float(np.percentile(latency, 50)), # milliseconds
+        latency_p95=float(np.percentile(latency, 95)),
+    )
+
+
+# Every combination of the grid values, as dicts
+def expand_grid(grid):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+# Evaluates every configuration of the grid on the first count frames with a pool of workers, jobs of at most chunk frames. Returns a list of
+# (params, metrics), in the order of the grid
+def evaluate(detector_name, intrinsics, frames, count, grid, workers=None, chunk=100):
+    module = importlib.import_module(detector_name)
+    configs = expand_grid(grid)
+    block, depth, meta = share_frames(frames, count)
+    try:
+        jobs = [(detector_name, intrinsics, params, start, min(start + chunk, len(meta)))
+                for params in configs for start in range(0, len(meta), chunk)]
+        with Pool(workers, initializer=init_worker, initargs=(block.name, depth.shape, meta)) as pool:
+            outputs = pool.map(run_job, jobs)
+    finally:
+        block.close()
+        block.unlink()
+
+    jobs_per_config = len(jobs) // len(configs)
+    report = []
+    for i, params in enumerate(configs):
+        results = [r for output in outputs[i * jobs_per_config:(i + 1) * jobs_per_config] for r in output]
+        # Scored against the drone size of the configuration when the grid changes it
+        report.append((params, score(results, meta, params.get('drone_width', module.drone_width), params.get('drone_height', module.drone_height))))
+    return report
+
+
+# "name=v1,v2,..." -> (name, [v1, v2, ...]), values are python literals
+def parse_grid_item(text):
+    name, _, values = text.partition('=')
+    return name, [ast.literal_eval(value) for value in values.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--detector', choices=('test1', 'test2', 'test3'), default='test2')
+    parser.add_argument('--source', default='synthetic', help="'synthetic' or the path of a recording directory")
+    parser.add_argument('--frames', type=int, default=300, help='number of synthetic frames, or the first frames of the recording')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--clutter', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--grid', nargs='*', default=[], help='parameters to sweep, e.g. far_threshold=1900,2100 tol=30,50')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes(all the cores by default)')
+    parser.add_argument('--chunk', type=int, default=100, help='frames per job')
+    parser.add_argument('--out', default=None, help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.detector)
+    if is_recording(args.source):
+        recording = Recording(args.source)
+        count = min(args.frames, len(recording))
+        frames = (recording[i] for i in range(count))
+        intrinsics = recording.intrinsics or scale_intrinsics(Intrinsics(640, 480, module.fx, module.fy, module.cx, module.cy), args.width, args.height)
+    else:
+        intrinsics = scale_intrinsics(Intrinsics(640, 480, module.fx, module.fy, module.cx, module.cy), args.width, args.height)
+        count = args.frames
+        frames = iter(SyntheticSource(intrinsics, num_frames=count, clutter=args.clutter, seed=args.seed))
+
+    if count <= 0:
+        parser.error('no frames to evaluate')
+    grid = dict(parse_grid_item(item) for item in args.grid)
+    report = evaluate(args.detector, intrinsics, frames, count, grid, args.workers, args.chunk)
+
+    # Best configurations first
+    report.sort(key=lambda entry: -(entry[1]['accuracy'] or 0))
+    for params, metrics in report:
+        print(params or 'defaults', ' '.join('%s=%s' % (name, '%.3f' % value if isinstance(value, float) else value) for name, value in metrics.items()))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump([dict(params=params, metrics=metrics) for params, metrics in report], f, indent=2)
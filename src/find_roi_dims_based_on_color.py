@@ -1,15 +1,12 @@
+import argparse
+import time
 import cv2
 import numpy as np
-import pyrealsense2 as rs
 
-# Initialize the camera pipeline
-pipeline = rs.pipeline()
-config = rs.config()
-config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
-config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
-
-# Start streaming
-pipeline.start(config)
+from calibration import Calibrator, save_calibration
+from frame_source import Intrinsics, add_source_arguments, open_source, scale_intrinsics, start_source
+from geometry import region_distance
+from instrument import add_metrics_arguments, open_metrics
 
 image_width = 640
 image_height = 480
@@ -17,36 +14,62 @@ tol_pix = 5
 tol_d = 0.02
 fx, fy, cx, cy = 6.0970550296798035e+02, 6.0909579671294716e+02, 3.1916667152289227e+02, 2.3558360480225772e+02
 
-try:
-    while True:
-        # Wait for the next set of frames from the camera
-        frames = pipeline.wait_for_frames()
+# Define the lower and upper bounds for the orange color
+lower_bound = np.array([0, 100, 100])
+upper_bound = np.array([30, 255, 255])
 
-        # Get the color and depth frames
-        color_frame = frames.get_color_frame()
-        depth_frame = frames.get_depth_frame()
+# Initialize the frame source(live camera, recorded .bag file or synthetic scenes)
+parser = add_metrics_arguments(add_source_arguments(argparse.ArgumentParser()))
+parser.add_argument('--calibrate', default=None, help='move the marker back and forth in front of the camera, fit its pixel size against distance and write the calibration to this JSON file when the stream ends or q is pressed')
+args = parser.parse_args()
+intrinsics = scale_intrinsics(Intrinsics(image_width, image_height, fx, fy, cx, cy), args.width, args.height)
+source = open_source(args, intrinsics)
+metrics, reporter = open_metrics(args) # stage times and skipped frames, see instrument.py
 
-        if not color_frame or not depth_frame:
-            continue
+# Start streaming. The calibration records the intrinsics the stream reports, the constants above only render the synthetic scenes
+intrinsics = start_source(source, intrinsics)
+
+# In calibration mode the marker is thresholded only around where it was on the previous frame, and
+# sampled at every distance it is seen at(see calibration.py)
+calibrator = None
+if args.calibrate:
+    calibrator = Calibrator(lower_bound, upper_bound, intrinsics)
 
-        # Convert the color frame to a NumPy array
-        frame = np.asanyarray(color_frame.get_data())
+try:
+    for frames in source: # Wait for the next set of frames
+        if frames is None:
+            metrics.count('skipped_frames')
+            continue
+        metrics.begin()
+
+        frame = frames.color_image
+
+        if calibrator is not None:
+            rect, window_mask = calibrator.add(frames)
+            metrics.lap('calibrate')
+            if rect is not None:
+                x, y, w, h = rect
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            cv2.imshow('Original Frame', frame)
+            cv2.imshow('Orange Regions', window_mask)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+            continue
 
         # Convert the frame to the HSV color space
         hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
 
-        # Define the lower and upper bounds for the orange color
-        lower_bound = np.array([0, 100, 100])
-        upper_bound = np.array([30, 255, 255])
-
         # Threshold the image to find the orange regions
         mask = cv2.inRange(hsv, lower_bound, upper_bound)
+        metrics.lap('threshold')
 
         # Find contours in the thresholded image
         contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
         # Find the contour with the maximum area
         max_contour = max(contours, key=cv2.contourArea, default=None)
+        metrics.observe('contours', len(contours))
+        metrics.lap('contours')
 
         # Draw bounding box around the largest contour
         if max_contour is not None:
@@ -58,8 +81,8 @@ try:
 
             # Check if the depth frame is valid at the centroid
             if 0 <= centroid[0] < image_width and 0 <= centroid[1] < image_height:
-                # Get the depth value at the centroid
-                depth_centroid = depth_frame.get_distance(centroid[0], centroid[1])
+                # Get the depth of the marker, the median over its bounding box rather than the single(noisy) pixel at the centroid
+                depth_centroid = region_distance(frames.depth_image, (x, y, w, h), frames.depth_scale)
 
                 # Check additional conditions for the ROI
                 if (
@@ -72,6 +95,8 @@ try:
                     roi_height_3d = (h * depth_centroid) / fy
                     print("Dims of ROI 3d: ", roi_width_3d, " and ", roi_height_3d)
                     print(" ")
+        metrics.lap('measure')
+        metrics.observe('latency_ms', (time.perf_counter() - frames.received_at) * 1000)
 
         # Display the original frame and the result
         cv2.imshow('Original Frame', frame)
@@ -83,5 +108,17 @@ try:
 
 finally:
     # Stop streaming and close all OpenCV windows
-    pipeline.stop()
+    source.stop()
     cv2.destroyAllWindows()
+    if reporter:
+        reporter.close()
+
+if calibrator is not None:
+    calibration = calibrator.fit()
+    if calibration is None:
+        print("Not enough distances to calibrate, the marker was sampled at", len(calibrator.samples), "distance(s)")
+    else:
+        save_calibration(args.calibrate, calibration)
+        print("ROI width  in pixels = %.1f/z + %.1f (rms %.1f px)" % (calibration['width'][0], calibration['width'][1], calibration['rms'][0]))
+        print("ROI height in pixels = %.1f/z + %.1f (rms %.1f px)" % (calibration['height'][0], calibration['height'][1], calibration['rms'][1]))
+        print("Calibration of", len(calibration['samples']), "distances written to", args.calibrate)
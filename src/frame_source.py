@@ -0,0 +1,306 @@
+import time
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+# Camera intrinsics of the depth/color stream (the scripts assume depth and color share them)
+Intrinsics = namedtuple('Intrinsics', ['width', 'height', 'fx', 'fy', 'cx', 'cy'])
+
+# Ground truth of a rendered gap: kind of scene, metric size(in meters), distance of the wall holding the gap and its pixel rectangle (x, y, w, h)
+GapTruth = namedtuple('GapTruth', ['kind', 'width', 'height', 'distance', 'rect'])
+
+SCENE_KINDS = ('wall', 'door', 'window')
+
+
+class EndOfStream(Exception):
+    pass
+
+
+class Frame:
+    # A coherent depth/color pair. depth_image is z16 (uint16) and color_image is bgr8, exactly what the scripts used to pull out of rs.frames
+    def __init__(self, depth_image, color_image, timestamp, frame_number, depth_scale=0.001, gap=None):
+        self.depth_image = depth_image
+        self.color_image = color_image
+        self.timestamp = timestamp # in milliseconds
+        self.frame_number = frame_number
+        self.depth_scale = depth_scale # meters per depth unit
+        self.gap = gap # GapTruth for synthetic frames, None otherwise
+        self.received_at = time.perf_counter() # host time at which the frame was read from the source
+
+    # Same meaning as rs.depth_frame.get_distance(): depth in meters at pixel (x, y)
+    def get_distance(self, x, y):
+        return float(self.depth_image[y, x]) * self.depth_scale
+
+
+class FrameSource:
+    # Base class of all the frame sources. read() returns a Frame, None if no coherent pair was available this time(the scripts 'continue' on it) and raises EndOfStream when there is nothing left to read
+    intrinsics = None
+    depth_scale = 0.001
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def read(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        while True:
+            try:
+                frame = self.read()
+            except EndOfStream:
+                return
+            yield frame
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class RealSenseSource(FrameSource):
+    # Live D455 stream, or a recorded RealSense .bag file if bag_file is given. Bag files are played back as fast as they can be decoded instead of in real time
+    def __init__(self, width=640, height=480, fps=30, bag_file=None):
+        import pyrealsense2 as rs # imported here so that the other sources work on machines without the RealSense SDK
+        self.rs = rs
+        self.width, self.height, self.fps = width, height, fps
+        self.bag_file = bag_file
+        self.pipeline = None
+
+    def start(self):
+        rs = self.rs
+        self.pipeline = rs.pipeline()
+        config = rs.config()
+        if self.bag_file is not None:
+            rs.config.enable_device_from_file(config, self.bag_file, repeat_playback=False)
+        config.enable_stream(rs.stream.depth, self.width, self.height, rs.format.z16, self.fps)
+        config.enable_stream(rs.stream.color, self.width, self.height, rs.format.bgr8, self.fps)
+        profile = self.pipeline.start(config)
+
+        if self.bag_file is not None:
+            profile.get_device().as_playback().set_real_time(False)
+
+        self.depth_scale = profile.get_device().first_depth_sensor().get_depth_scale()
+        intr = profile.get_stream(rs.stream.depth).as_video_stream_profile().get_intrinsics()
+        self.intrinsics = Intrinsics(intr.width, intr.height, intr.fx, intr.fy, intr.ppx, intr.ppy)
+
+    def stop(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+
+    def read(self):
+        # Wait for a coherent pair of frames
+        ok, frames = self.pipeline.try_wait_for_frames(5000)
+        if not ok:
+            if self.bag_file is not None:
+                raise EndOfStream() # the recording has been played back completely
+            return None
+
+        depth_frame = frames.get_depth_frame()
+        color_frame = frames.get_color_frame()
+        if not depth_frame or not color_frame:
+            return None
+
+        return Frame(np.asanyarray(depth_frame.get_data()), np.asanyarray(color_frame.get_data()),
+                     frames.get_timestamp(), frames.get_frame_number(), self.depth_scale)
+
+
+class SyntheticSource(FrameSource):
+    # Procedural generator of depth/color pairs of a wall with a door or a window(or no gap at all) in front of the camera. Every frame carries the ground truth of the rendered gap in frame.gap.
+    # If static is set, one scene is rendered once and returned over and over(with fresh noise if noise is set), otherwise a new random scene is drawn for every frame
+    def __init__(self, intrinsics, kind=None, num_frames=None, static=False, clutter=0, noise=True, seed=0,
+                 gap_size=None, wall_distance=None, depth_scale=0.001):
+        self.intrinsics = intrinsics
+        self.kind = kind # one of SCENE_KINDS, None picks a random kind for every scene
+        self.num_frames = num_frames # None means an endless stream
+        self.static = static
+        self.clutter = clutter # number of boxes placed between the camera and the wall
+        self.noise = noise
+        self.gap_size = gap_size # (width, height) of the gap in meters, random if None
+        self.wall_distance = wall_distance # in meters, random if None
+        self.depth_scale = depth_scale
+        self.rng = np.random.default_rng(seed)
+        self.frame_number = 0
+        self.scene = None
+
+        # Normalized image coordinates of every column and row, i.e. the ray through pixel (u, v) is (xn[u], yn[v], 1)
+        self.xn = (np.arange(intrinsics.width) - intrinsics.cx) / intrinsics.fx
+        self.yn = (np.arange(intrinsics.height) - intrinsics.cy) / intrinsics.fy
+
+    # Colors(bgr) of the surfaces in the color image
+    palette = np.array([
+        [150, 150, 150], # wall
+        [60, 120, 200],  # background seen through the gap
+        [70, 90, 60],    # floor
+        [40, 40, 180],   # clutter
+    ], dtype=np.uint8)
+
+    def draw_scene(self):
+        rng = self.rng
+        kind = self.kind if self.kind is not None else SCENE_KINDS[rng.integers(len(SCENE_KINDS))]
+        wall = self.wall_distance if self.wall_distance is not None else rng.uniform(1.0, 4.0)
+        camera_height = rng.uniform(0.8, 1.5) # height of the camera above the floor
+
+        if kind == 'wall':
+            gap_w = gap_h = 0.0
+            gap_x = gap_y = 0.0
+        else:
+            if self.gap_size is not None:
+                gap_w, gap_h = self.gap_size
+            elif kind == 'door':
+                gap_w, gap_h = rng.uniform(0.2, 1.2), rng.uniform(0.8, 2.1)
+            else:
+                gap_w, gap_h = rng.uniform(0.15, 1.2), rng.uniform(0.1, 1.0)
+            gap_x = rng.uniform(-0.3, 0.3) # horizontal offset of the gap center from the optical axis
+            if kind == 'door':
+                gap_y = camera_height - gap_h/2 # doors start on the floor(y axis of the camera points downwards)
+            else:
+                gap_y = rng.uniform(-0.3, 0.3)
+
+        boxes = []
+        for _ in range(self.clutter):
+            z = rng.uniform(0.5, wall - 0.2) if wall > 0.7 else wall
+            boxes.append((rng.uniform(-1.0, 1.0), rng.uniform(-0.8, camera_height), rng.uniform(0.1, 0.5), rng.uniform(0.1, 0.5), z))
+
+        return dict(kind=kind, wall=wall, back=wall + rng.uniform(1.5, 4.0), camera_height=camera_height,
+                    gap=(gap_x, gap_y, gap_w, gap_h), boxes=boxes)
+
+    def render(self, scene):
+        intr = self.intrinsics
+        xn, yn = self.xn, self.yn
+        wall, back = scene['wall'], scene['back']
+        gap_x, gap_y, gap_w, gap_h = scene['gap']
+
+        depth = np.full((intr.height, intr.width), wall, dtype=np.float32)
+        label = np.zeros((intr.height, intr.width), dtype=np.uint8)
+
+        # Pixels seeing through the gap see the background
+        in_x = np.abs(xn*wall - gap_x) < gap_w/2
+        in_y = np.abs(yn*wall - gap_y) < gap_h/2
+        if scene['kind'] == 'door':
+            in_y |= yn*wall >= gap_y # the door opening continues down to the floor
+        hole = in_y[:, None] & in_x[None, :]
+        depth[hole] = back
+        label[hole] = 1
+
+        # Floor plane, visible wherever it is hit before the wall/background
+        with np.errstate(divide='ignore'):
+            z_floor = np.where(yn > 0, scene['camera_height'] / yn, np.inf).astype(np.float32)
+        floor = z_floor[:, None] < depth
+        depth = np.where(floor, z_floor[:, None], depth)
+        label[floor] = 2
+
+        # Clutter boxes, fronto-parallel rectangles in front of the wall
+        for bx, by, bw, bh, bz in scene['boxes']:
+            box = (np.abs(yn*bz - by) < bh/2)[:, None] & (np.abs(xn*bz - bx) < bw/2)[None, :]
+            box &= depth > bz
+            depth[box] = bz
+            label[box] = 3
+
+        # Pixel rectangle of the gap where it opens in the wall
+        rect = None
+        if gap_w > 0 and in_x.any() and in_y.any():
+            cols, rows = np.flatnonzero(in_x), np.flatnonzero(in_y)
+            rect = (int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1))
+        truth = GapTruth(scene['kind'], gap_w, gap_h, wall, rect)
+
+        return depth, label, truth
+
+    def read(self):
+        if self.num_frames is not None and self.frame_number >= self.num_frames:
+            raise EndOfStream()
+
+        if self.scene is None or not self.static:
+            self.scene = self.draw_scene()
+            self.rendered = self.render(self.scene)
+        depth, label, truth = self.rendered
+
+        if self.noise:
+            # Stereo depth noise grows with the square of the distance; a few pixels are dropped(invalid depth = 0) as the D455 does
+            depth = depth + self.rng.standard_normal(depth.shape, dtype=np.float32) * (0.002 * depth * depth)
+            depth[self.rng.random(depth.shape, dtype=np.float32) < 0.01] = 0
+
+        depth_image = np.clip(depth / self.depth_scale, 0, 65535).astype(np.uint16)
+        color_image = self.palette[label]
+
+        frame = Frame(depth_image, color_image, time.time() * 1000, self.frame_number, self.depth_scale, truth)
+        self.frame_number += 1
+        return frame
+
+
+# Checks the --source option while the arguments are parsed, so that an unknown source is reported as a usage error
+def source_type(value):
+    from recording import is_recording # imported here, recording builds on this module
+    if value in ('realsense', 'synthetic') or value.endswith('.bag') or is_recording(value):
+        return value
+    raise argparse.ArgumentTypeError('unknown frame source: ' + value)
+
+
+# Command line options shared by all the scripts to select where the frames come from
+def add_source_arguments(parser):
+    parser.add_argument('--source', type=source_type, default='realsense', help="'realsense' for the live camera, 'synthetic' for generated scenes, the path of a recorded .bag file or of a recording directory(see --record)")
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--frames', type=int, default=None, help='stop after this many frames(synthetic source, recordings)')
+    parser.add_argument('--scene', choices=SCENE_KINDS, default=None, help='kind of synthetic scene, random if not given')
+    parser.add_argument('--clutter', type=int, default=0, help='number of obstacles in the synthetic scenes')
+    parser.add_argument('--static', action='store_true', help='render one synthetic scene and keep returning it')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record', default=None, help='also write the frames to this recording directory')
+    parser.add_argument('--compress', action='store_true', help='compress the chunks of the recording')
+    parser.add_argument('--real-time', action='store_true', help='replay a recording at the pace it was recorded instead of as fast as possible')
+    parser.add_argument('--temporal', type=int, default=0, help='filter every depth pixel over this many frames(see temporal.py), 0 disables it')
+    parser.add_argument('--temporal-mode', choices=('median', 'min'), default='median', help='median or closest valid depth over the frames')
+    parser.add_argument('--fill', type=int, default=5, help='fill the pixels with no valid depth over the frames from this neighbourhood(pixels), 0 disables it')
+    return parser
+
+
+# Approximate intrinsics of the same camera streaming at another resolution, for the synthetic scenes: the image is scaled by the ratio of the
+# heights and widened or narrowed around the principal point, so that the pixels stay square(848x480 sees more of the scene than 640x480, it
+# does not stretch it). The camera, .bag files and recordings report their own intrinsics, see start_source
+def scale_intrinsics(intrinsics, width, height):
+    if (width, height) == (intrinsics.width, intrinsics.height):
+        return intrinsics
+    s = height / intrinsics.height
+    return Intrinsics(width, height, intrinsics.fx*s, intrinsics.fy*s, intrinsics.cx*s + (width - intrinsics.width*s)/2, intrinsics.cy*s)
+
+
+# intrinsics are used to render the synthetic scenes, the camera reports its own. With --record the frames are also written to a recording
+def open_source(args, intrinsics):
+    # Imported here, recording and temporal build on this module
+    from recording import RecordedSource, TeeSource, is_recording
+    from temporal import FilteredSource
+
+    if args.source == 'realsense':
+        source = RealSenseSource(args.width, args.height, args.fps)
+    elif args.source == 'synthetic':
+        intrinsics = scale_intrinsics(intrinsics, args.width, args.height)
+        source = SyntheticSource(intrinsics, kind=args.scene, num_frames=args.frames, static=args.static,
+                                 clutter=args.clutter, seed=args.seed)
+    elif args.source.endswith('.bag'):
+        source = RealSenseSource(args.width, args.height, args.fps, bag_file=args.source)
+    elif is_recording(args.source):
+        source = RecordedSource(args.source, stop=args.frames, real_time=args.real_time)
+    else:
+        raise ValueError('Unknown frame source: ' + args.source) # rejected by source_type when parsing the command line
+
+    if args.record:
+        source = TeeSource(source, args.record, compress=args.compress)
+    if args.temporal > 0:
+        # After the recording, which keeps the raw frames
+        source = FilteredSource(source, args.temporal, args.temporal_mode, args.fill)
+    return source
+
+
+# Starts the source and returns the intrinsics the detectors must be built with: the ones the camera, the .bag file or the recording reports
+# (only known once the stream is started), those the synthetic scenes are rendered with, intrinsics if the source has none
+def start_source(source, intrinsics):
+    source.start()
+    return source.intrinsics if source.intrinsics is not None else intrinsics
@@ -0,0 +1,213 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# Metric size of a gap: width and height(in meters) between its edges, distance to the plane holding it, normal(unit vector, pointing towards
+# the camera) and rms residual of the plane fitted on the border of the gap. Values which could not be measured are nan(normal None).
+# missing names the edges(EDGES) around which no valid depth was found, the width and/or height is nan then
+GapSize = namedtuple('GapSize', ['width', 'height', 'distance', 'normal', 'residual', 'missing'], defaults=((),))
+
+EDGES = ('left', 'right', 'top', 'bottom')
+
+
+class RayTable:
+    # Direction of the ray through every pixel, computed once from the intrinsics: the point seen at pixel (u, v) with depth z is
+    # (ray_x[v, u]*z, ray_y[v, u]*z, z). This replaces the x*z/fx arithmetic done pixel by pixel in the main loops
+    def __init__(self, intrinsics):
+        self.intrinsics = intrinsics
+        self.xn = ((np.arange(intrinsics.width) - intrinsics.cx) / intrinsics.fx).astype(np.float32)
+        self.yn = ((np.arange(intrinsics.height) - intrinsics.cy) / intrinsics.fy).astype(np.float32)
+        self.ray_x = np.ascontiguousarray(np.broadcast_to(self.xn, (intrinsics.height, intrinsics.width)))
+        self.ray_y = np.ascontiguousarray(np.broadcast_to(self.yn[:, None], (intrinsics.height, intrinsics.width)))
+
+    # Normalized coordinate of a pixel boundary(u or v can be fractional, e.g. x-0.5 is the left border of column x)
+    def edge_x(self, u):
+        return (u - self.intrinsics.cx) / self.intrinsics.fx
+
+    def edge_y(self, v):
+        return (v - self.intrinsics.cy) / self.intrinsics.fy
+
+    # 3D points(N x 3, in meters) of the pixels selected by mask(bool array or a (slice, slice) pair). Pixels with invalid depth(0) are skipped
+    def deproject(self, depth_image, depth_scale, mask):
+        z = depth_image[mask].astype(np.float32) * np.float32(depth_scale)
+        valid = z > 0
+        z = z[valid]
+        return np.stack([self.ray_x[mask][valid] * z, self.ray_y[mask][valid] * z, z], axis=-1)
+
+
+# Robust distance(in meters) of the surface seen within rect = (x, y, w, h): the given percentile of the valid depths, nan if there are none
+def region_distance(depth_image, rect, depth_scale, percentile=50):
+    x, y, w, h = rect
+    z = depth_image[max(y, 0):y + h, max(x, 0):x + w]
+    z = z[z > 0]
+    if z.size == 0:
+        return float('nan')
+    return float(np.percentile(z, percentile)) * depth_scale
+
+
+# Why the size of a gap is incomplete, for the decision records: None if its width and height were measured
+def missing_reason(gap):
+    if gap.missing:
+        return 'no valid depth around the %s edge%s of the gap' % (', '.join(gap.missing), 's' if len(gap.missing) > 1 else '')
+    if math.isnan(gap.width) or math.isnan(gap.height):
+        return 'the depths of the edges of the gap give no positive %s' % ('width' if math.isnan(gap.width) else 'height')
+    return None
+
+
+# Percentile of the values of every group(linear interpolation, as np.percentile), nan for a group without any. ordered holds the values
+# sorted by group and then by value, counts the number of values of every group
+def group_percentile(ordered, counts, percentile):
+    ordered = np.append(ordered, 0) # read by the groups without values
+    first = np.cumsum(counts) - counts
+    position = percentile / 100 * np.maximum(counts - 1, 0)
+    low = np.floor(position).astype(np.intp)
+    lo = ordered[first + low].astype(np.float64)
+    hi = ordered[first + np.ceil(position).astype(np.intp)].astype(np.float64)
+    return np.where(counts > 0, lo + (hi - lo) * (position - low), np.nan)
+
+
+# Percentile of the z16 depths of every group(group < n), from one sort of (group, depth) keys
+def group_depth_percentile(z, group, n, percentile):
+    key = np.uint32 if n <= 0xFFFF else np.uint64
+    ordered = (np.sort(group.astype(key) << 16 | z) & 0xFFFF).astype(np.uint16)
+    return group_percentile(ordered, np.bincount(group, minlength=n), percentile)
+
+
+# Row and column of every step-th pixel of every step-th row of the rectangles of bounds((first row, last row + 1, first column, last
+# column + 1) per row, empty if last <= first), and the index of the rectangle each pixel belongs to, in the order of the rectangles
+def gather(bounds, step=1):
+    heights = np.maximum(-(-(bounds[:, 1] - bounds[:, 0]) // step), 0)
+    widths = np.maximum(-(-(bounds[:, 3] - bounds[:, 2]) // step), 0)
+    sizes = heights * widths
+    label = np.repeat(np.arange(len(bounds), dtype=np.int32), sizes)
+    row, col = np.divmod(np.arange(len(label), dtype=np.int32) - np.repeat((np.cumsum(sizes) - sizes).astype(np.int32), sizes),
+                         np.repeat(widths.astype(np.int32), sizes))
+    if step > 1:
+        row *= step
+        col *= step
+    row += np.repeat(bounds[:, 0].astype(np.int32), sizes)
+    col += np.repeat(bounds[:, 2].astype(np.int32), sizes)
+    return label, row, col
+
+
+# Indices of at most max_points evenly spread values(every step-th one) of every group of group(group < n, the values of a group contiguous),
+# and the group of each
+def spread(group, n, max_points):
+    counts = np.bincount(group, minlength=n)
+    step = np.maximum(-(-counts // max_points), 1)
+    sizes = -(-counts // step)
+    starts = np.cumsum(sizes) - sizes
+    kept = np.repeat(np.cumsum(counts) - counts - starts * step, sizes) + np.arange(sizes.sum()) * np.repeat(step, sizes)
+    return kept, np.repeat(np.arange(n, dtype=group.dtype), sizes)
+
+
+# Least squares planes z = a*x + b*y + c through the points(N x 3) of every group(group < n, the points of a group contiguous), each refitted
+# once without its outliers(residual above 3 median absolute deviations). All the groups are solved at once from sums over their points
+# (normal equations). Returns the unit normals(n x 3) pointing towards the camera(negative z) and the rms residuals, nan for the groups with
+# less than 3 points
+def fit_planes(points, group, n):
+    counts = np.bincount(group, minlength=n)
+    first = np.cumsum(counts) - counts
+    filled = counts > 0
+    fitted = counts >= 3
+    x, y, z = points.T
+    products = np.stack([x * x, x * y, x, y * y, y, np.ones_like(x), x * z, y * z, z])
+
+    def solve(weights):
+        # Normal equations, one 3x3 system per group, from sums over the contiguous points of every group
+        sums = np.zeros((9, n))
+        sums[:, filled] = np.add.reduceat(products * weights, first[filled], axis=1)
+        AtA = sums[[0, 1, 2, 1, 3, 4, 2, 4, 5]].T.reshape(n, 3, 3) # sums of x*x, x*y, x, y*y, y and 1
+        AtA[~fitted] = np.eye(3) # no plane through less than 3 points, their result is dropped
+        Atz = sums[6:].T[:, :, None] # sums of x*z, y*z and z
+        try:
+            coeffs = np.linalg.solve(AtA, Atz)[:, :, 0]
+        except np.linalg.LinAlgError:
+            coeffs = (np.linalg.pinv(AtA) @ Atz)[:, :, 0] # degenerate points(e.g. all on a line), solved like lstsq
+        return z - x * coeffs[group, 0] - y * coeffs[group, 1] - coeffs[group, 2], coeffs
+
+    residual, coeffs = solve(1.0)
+    # Median absolute residual of every group: sorted by value, then stably by group
+    absolute = np.abs(residual)
+    order = np.argsort(absolute)
+    order = order[np.argsort(group[order].astype(np.uint16 if n <= 0xFFFF else np.int64), kind='stable')]
+    mad = group_percentile(absolute[order], counts, 50)
+    inliers = absolute <= 3 * mad[group] + 1e-6
+    kept = np.bincount(group, inliers, minlength=n)
+    refit = (kept >= 3) & (kept < counts)
+    if refit.any():
+        refitted, refit_coeffs = solve(inliers)
+        residual = np.where(refit[group], refitted, residual)
+        coeffs = np.where(refit[:, None], refit_coeffs, coeffs)
+    used = np.where(refit[group], inliers, True)
+    rms = np.sqrt(np.bincount(group, residual**2 * used, minlength=n) / np.maximum(np.where(refit, kept, counts), 1))
+
+    # The plane is z - a*x - b*y = c, (-a, -b, 1) points away from the camera(+z)
+    normals = np.column_stack([coeffs[:, 0], coeffs[:, 1], -np.ones(n)])
+    normals /= np.linalg.norm(normals, axis=1)[:, None]
+    normals[~fitted] = np.nan
+    rms[~fitted] = np.nan
+    return normals, rms
+
+
+# The bands of measure_gaps as (x, y, w, h) @ BAND_RECTS + band * BAND_WIDTHS, 4 rows of (first row, last row + 1, first column, last column
+# + 1) per rectangle: left [y, y + h, x - band, x], right [y, y + h, x + w, x + w + band], top [y - band, y, x, x + w], bottom [y + h,
+# y + h + band, x, x + w]
+BAND_RECTS = np.array([
+    # left          right           top             bottom
+    [0, 0, 1, 1,    0, 0, 1, 1,     0, 0, 1, 1,     0, 0, 1, 1], # x
+    [1, 1, 0, 0,    1, 1, 0, 0,     1, 1, 0, 0,     1, 1, 0, 0], # y
+    [0, 0, 0, 0,    0, 0, 1, 1,     0, 0, 0, 1,     0, 0, 0, 1], # w
+    [0, 1, 0, 0,    0, 1, 0, 0,     0, 0, 0, 0,     1, 1, 0, 0], # h
+])
+BAND_WIDTHS = np.array([0, 0, -1, 0,    0, 0, 0, 1,     -1, 0, 0, 0,    0, 1, 0, 0])
+
+
+# Metric size of the gaps seen as rects = (x, y, w, h) in the depth image, a GapSize per rectangle.
+# The edges of a gap lie on the obstacle around it, so the depth of each edge is measured on a band of pixels just outside the rectangle as a
+# percentile over the whole band, which makes it insensitive to single-pixel depth noise. An edge whose band has no valid depth(or lies out of
+# the image) is missing: the band just inside the rectangle would see through the gap and inflate its size, so the width or height across it
+# is nan. So is a width or height which comes out negative(edges at very different depths). The pixels of the 4 bands of all the gaps are
+# gathered with one index array, their percentiles come from a single sort of (band, depth) keys, and the bands are deprojected in one step
+# and a plane is fitted on the bands of every gap
+def measure_gaps(depth_image, rects, rays, depth_scale, band=4, percentile=50, max_points=1024):
+    rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+    n = len(rects)
+    H, W = depth_image.shape
+    x, y, w, h = rects.T
+
+    # (first row, last row + 1, first column, last column + 1) of the bands outside every rectangle in the order of EDGES, clipped to the image
+    bands = (rects @ BAND_RECTS + band * BAND_WIDTHS).reshape(-1, 4)
+    bands = np.clip(bands, 0, [H, H, W, W])
+    label, row, col = gather(bands)
+    z = depth_image[row, col]
+    valid = z > 0
+    label, row, col, z = label[valid], row[valid], col[valid], z[valid]
+
+    # Depth of every edge, missing if its band has no valid depth
+    edges = group_depth_percentile(z, label, 4 * n, percentile).reshape(n, 4) * depth_scale
+    left, right, top, bottom = edges.T
+
+    # Width between the left border of the first column and the right border of the last one, height likewise
+    widths = rays.edge_x(x + w - 0.5) * right - rays.edge_x(x - 0.5) * left
+    heights = rays.edge_y(y + h - 0.5) * bottom - rays.edge_y(y - 0.5) * top
+    widths[~(widths > 0)] = np.nan
+    heights[~(heights > 0)] = np.nan
+
+    gap = label // 4
+    distances = group_depth_percentile(z, gap, n, 50) * depth_scale
+
+    # At most max_points evenly spread points of every gap are deprojected for its plane, so that the cost does not grow with the resolution
+    kept, group = spread(gap, n, max_points)
+    normals, residuals = fit_planes(rays.deproject(depth_image, depth_scale, (row[kept], col[kept])).astype(np.float64), group, n)
+
+    return [GapSize(float(widths[i]), float(heights[i]), float(distances[i]),
+                    None if np.isnan(residuals[i]) else tuple(float(v) for v in normals[i]), float(residuals[i]),
+                    tuple(edge for edge, depth in zip(EDGES, edges[i]) if np.isnan(depth)))
+            for i in range(n)]
+
+
+# Metric size of the gap seen as rect = (x, y, w, h) in the depth image, see measure_gaps
+def measure_gap(depth_image, rect, rays, depth_scale, band=4, percentile=50):
+    return measure_gaps(depth_image, [rect], rays, depth_scale, band, percentile)[0]
@@ -0,0 +1,221 @@
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Stage timers for the detectors. A detector calls timer.begin() when it starts on a frame and timer.lap(name) at the end of every stage: the
+# time since the previous mark is attributed to that stage. Laps need no change to the structure of the code being timed, and with the
+# NullTimer(the default of every detector) they cost one empty method call. The same object takes counters(count) and observed values
+# (observe, e.g. latencies or numbers of contours) when the scripts run with --metrics.
+
+
+class NullTimer:
+    def begin(self):
+        pass
+
+    def lap(self, name):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class StageTimer(NullTimer):
+    # Keeps every duration(seconds) per stage. If trace_allocations is set(tracemalloc must be tracing), the bytes allocated by each stage
+    # are kept as well: the peak of the traced memory during the stage above the memory traced when it started, which counts the temporary
+    # arrays too. Tracing slows everything down, allocations and durations should be measured in separate runs
+    def __init__(self, trace_allocations=False):
+        self.trace_allocations = trace_allocations
+        self.durations = defaultdict(list)
+        self.allocations = defaultdict(list)
+        self.last = None
+        self.traced = 0
+
+    def begin(self):
+        if self.trace_allocations:
+            self.traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.durations[name].append(now - self.last)
+        if self.trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            self.allocations[name].append(peak - self.traced)
+            self.traced = current
+            tracemalloc.reset_peak()
+            now = time.perf_counter() # the bookkeeping is not counted in the next stage
+        self.last = now
+
+    def reset(self):
+        self.durations.clear()
+        self.allocations.clear()
+
+    # Per stage statistics: number of samples, mean/p50/p99 duration in microseconds and p50/max bytes allocated(if traced)
+    def summary(self):
+        stats = {}
+        for name, durations in self.durations.items():
+            us = np.array(durations) * 1e6
+            stats[name] = dict(count=len(us), mean_us=float(us.mean()), p50_us=float(np.percentile(us, 50)), p99_us=float(np.percentile(us, 99)))
+            if self.allocations.get(name):
+                stats[name].update(alloc_p50=int(np.percentile(self.allocations[name], 50)), alloc_max=int(max(self.allocations[name])))
+        return stats
+
+
+class Rolling:
+    # The last size values of a metric, in a ring buffer: adding a value is one array store, the statistics are computed when a report is made
+    def __init__(self, size=1024):
+        self.values = np.zeros(size)
+        self.total = 0 # values added since the start
+
+    def add(self, value):
+        self.values[self.total % len(self.values)] = value
+        self.total += 1
+
+    def window(self):
+        return self.values[:min(self.total, len(self.values))]
+
+
+# Bucket edges of the histograms of the reports, powers of 2
+HISTOGRAM_EDGES = 2.0 ** np.arange(-4, 21)
+
+
+class Metrics:
+    # Instrumentation of the flight loop: stage times(microseconds, begin/lap as in StageTimer), counters and observed values, each stage and
+    # observed value keeping its last window values. Reports are made from other threads(endpoint, dump) while the loop keeps recording: new
+    # names are added and the tables are copied for a report under a lock, so a report never iterates over a table that is growing. Recording
+    # into a name that already exists takes no lock
+    def __init__(self, window=1024):
+        self.window = window
+        self.stages = {}
+        self.values = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.local = threading.local() # laps of the detector and of the other loops(find_roi) may run in different threads
+
+    # Rolling of name in table(stages or values), added on first use
+    def rolling(self, table, name):
+        rolling = table.get(name)
+        if rolling is None:
+            with self.lock:
+                rolling = table.setdefault(name, Rolling(self.window))
+        return rolling
+
+    def begin(self):
+        self.local.last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.rolling(self.stages, name).add((now - self.local.last) * 1e6)
+        self.local.last = now
+
+    def count(self, name, n=1):
+        with self.lock: # counted from the capture and the processing threads
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        self.rolling(self.values, name).add(value)
+
+    # Plain text report: one line per counter, one line per stage/value with count, percentiles and the histogram of the window(non-empty
+    # buckets, 'le' being the upper edge of the bucket)
+    def report(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            tables = (('stage_us', sorted(self.stages.items())), ('value', sorted(self.values.items())))
+        lines = ['uptime_s %.1f' % (time.time() - self.started)]
+        for name, n in counters:
+            lines.append('%s %d' % (name, n))
+        for prefix, table in tables:
+            for name, rolling in table:
+                values = rolling.window().copy()
+                if not len(values):
+                    continue
+                p50, p90, p99 = np.percentile(values, (50, 90, 99))
+                counts, _ = np.histogram(values, np.concatenate([[-np.inf], HISTOGRAM_EDGES, [np.inf]]))
+                edges = list(HISTOGRAM_EDGES) + [np.inf]
+                histogram = ' '.join('le%g:%d' % (edge, c) for edge, c in zip(edges, counts) if c)
+                lines.append('%s{%s} total=%d p50=%.1f p90=%.1f p99=%.1f max=%.1f %s' % (prefix, name, rolling.total, p50, p90, p99, values.max(), histogram))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    # Serves the report of the metrics as plain text on http://host:port/ (localhost only by default)
+    def __init__(self, metrics, port=8000, host='127.0.0.1'):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.report().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass # no line on the console for every request
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsDump:
+    # Rewrites the report of the metrics to a file every interval seconds(and once more when closed). The file is replaced atomically, a
+    # reader never sees half a report
+    def __init__(self, metrics, path, interval=1.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, name='metrics-dump', daemon=True)
+        self.thread.start()
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.metrics.report())
+        os.replace(tmp, self.path)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.dump()
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics', default=None, help="instrument the loop and report on 'http:<port>' (text on localhost) or 'file:<path>[:<seconds>]'")
+    return parser
+
+
+# Returns the metrics to pass to the detector and the pipeline(NULL_TIMER if --metrics is not given) and the reporter to close at the end
+# (None if there is none)
+def open_metrics(args):
+    if args.metrics is None:
+        return NULL_TIMER, None
+    metrics = Metrics()
+    kind, _, target = args.metrics.partition(':')
+    if kind == 'http':
+        return metrics, MetricsServer(metrics, int(target))
+    if kind == 'file':
+        path, _, interval = target.partition(':')
+        return metrics, MetricsDump(metrics, path, float(interval) if interval else 1.0)
+    raise ValueError('Unknown metrics output: ' + args.metrics)
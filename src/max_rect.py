@@ -0,0 +1,135 @@
+import cv2
+import numpy as np
+
+# Largest obstacle-free axis-aligned rectangle in a binary mask(True/non-zero = free pixel).
+#
+# This is the row-wise histogram method: for every pixel, the histogram height is the number of free pixels above it in its column and the
+# rectangle of that height around the pixel extends left/right until a shorter bar is met. Instead of walking every row with a monotonic stack
+# in Python, the left/right extents are computed for all the rows at once with cumulative max/min along the columns, so the whole search is a
+# handful of whole-array NumPy operations, O(W*H). Any number of leading batch axes are allowed: free[..., H, W]
+
+
+# Returns the height, left and right(exclusive) extents of the maximal rectangle "hanging" above every pixel. The rectangle of pixel (i, j) spans
+# rows i-height+1..i and columns left..right-1, its area is height*(right-left) and it is 0 for blocked pixels
+def maximal_rects(free):
+    free = np.asarray(free).astype(bool, copy=False)
+    H, W = free.shape[-2:]
+    blocked = ~free
+    rows = np.arange(H, dtype=np.int32)[:, None]
+    cols = np.arange(W, dtype=np.int32)
+
+    # Histogram heights: rows since the last blocked pixel in the same column
+    last_blocked = np.where(blocked, rows, np.int32(-1))
+    np.maximum.accumulate(last_blocked, axis=-2, out=last_blocked)
+    height = rows - last_blocked
+
+    # Extent of the horizontal run of free pixels each pixel belongs to
+    run_left = np.where(blocked, cols + 1, np.int32(0))
+    np.maximum.accumulate(run_left, axis=-1, out=run_left)
+    run_right = np.where(blocked, cols, np.int32(W))[..., ::-1]
+    run_right = np.minimum.accumulate(run_right, axis=-1)[..., ::-1]
+
+    # The rectangle can only be as wide as the narrowest run in the bar above the pixel: a cumulative max(min) down the column, restarted at
+    # every blocked pixel. The restart is done by offsetting each vertical segment so that a later segment always dominates the earlier ones
+    segment = np.cumsum(blocked, axis=-2, dtype=np.int32) * np.int32(W + 1)
+    left = np.where(blocked, np.int32(0), run_left) + segment
+    np.maximum.accumulate(left, axis=-2, out=left)
+    left -= segment
+    right = np.where(blocked, np.int32(W), run_right) - segment
+    np.minimum.accumulate(right, axis=-2, out=right)
+    right += segment
+
+    return height, left, right
+
+
+# Batched search: returns rects[..., 4] as (x, y, w, h) and their areas[...]. Masks without any free pixel give a (0, 0, 0, 0) rectangle of area 0
+def largest_empty_rects(free):
+    height, left, right = maximal_rects(free)
+    H, W = height.shape[-2:]
+    area = height * (right - left)
+
+    flat = area.reshape(area.shape[:-2] + (H*W,))
+    best = np.argmax(flat, axis=-1)[..., None]
+    i, j = np.divmod(best[..., 0], W)
+
+    def pick(a):
+        return np.take_along_axis(a.reshape(flat.shape), best, axis=-1)[..., 0]
+
+    h, l, r = pick(height), pick(left), pick(right)
+    rects = np.stack([l, i - h + 1, r - l, h], axis=-1)
+    areas = pick(area)
+    rects[areas == 0] = 0
+    return rects, areas
+
+
+# Largest empty rectangle of a single mask as (x, y, w, h), None if there is no free pixel. offset=(x0, y0) is added to the result, e.g. to
+# search only within an ROI slice and get the rectangle back in image coordinates
+def largest_empty_rect(free, offset=(0, 0)):
+    rects, areas = largest_empty_rects(free)
+    if areas == 0:
+        return None
+    x, y, w, h = (int(v) for v in rects)
+    return x + offset[0], y + offset[1], w, h
+
+
+# Largest empty rectangle searched on the mask decimated by factor, for a cost bounded by the size of the decimated mask. A block of factor x
+# factor pixels is free only if all its pixels are, so the coarse rectangle scaled back is free at full resolution; each of its edges is then
+# pushed out by up to factor - 1 pixels while the strip it sweeps stays free. The result never contains a blocked pixel but it is not always
+# the largest one: a gap narrower than 2 blocks can be missed, and a rectangle that only fits across the block grid is found smaller. None
+# if there is no free block, e.g. the mask is smaller than a block
+def largest_empty_rect_decimated(free, factor, offset=(0, 0)):
+    free = np.asarray(free, dtype=np.uint8)
+    H, W = free.shape
+    h, w = H // factor, W // factor
+    if h == 0 or w == 0:
+        return None
+    blocks = cv2.erode(free, np.ones((factor, factor), np.uint8), borderType=cv2.BORDER_REPLICATE)[factor//2::factor, factor//2::factor][:h, :w]
+    coarse = largest_empty_rect(blocks)
+    if coarse is None:
+        return None
+    x1, y1 = coarse[0] * factor, coarse[1] * factor
+    x2, y2 = x1 + coarse[2] * factor, y1 + coarse[3] * factor
+
+    # Number of free lines at the start of a strip, lines being its columns(axis 0) or rows(axis 1)
+    def run(strip, axis):
+        lines = strip.all(axis=axis)
+        return int(lines.argmin()) if not lines.all() else len(lines)
+
+    g = factor - 1
+    x1 -= run(free[y1:y2, max(x1 - g, 0):x1][:, ::-1], 0)
+    x2 += run(free[y1:y2, x2:x2 + g], 0)
+    y1 -= run(free[max(y1 - g, 0):y1, x1:x2][::-1], 1)
+    y2 += run(free[y2:y2 + g, x1:x2], 1)
+    return x1 + offset[0], y1 + offset[1], x2 - x1, y2 - y1
+
+
+# The k largest distinct maximal rectangles of a single mask, as a list of (x, y, w, h) sorted by decreasing area. Rectangles that can still grow
+# downwards(same extents one row below) are not maximal and are dropped. Every maximal rectangle is found once per pixel of its bottom row, so
+# the candidates are deduplicated before the k largest are returned
+def top_k_empty_rects(free, k, offset=(0, 0), min_area=1):
+    height, left, right = maximal_rects(free)
+    W = height.shape[-1]
+    area = height * (right - left)
+    grows = (height[1:] > 0) & (left[1:] == left[:-1]) & (right[1:] == right[:-1])
+    area[:-1][grows] = 0
+    area = area.ravel()
+    n = np.count_nonzero(area >= min_area)
+
+    pool = min(n, 64 * k)
+    while True:
+        idx = np.argpartition(area, area.size - pool)[area.size - pool:] if pool else np.empty(0, dtype=np.intp)
+        i, j = np.divmod(idx, W)
+        h = height.ravel()[idx]
+        l = left.ravel()[idx]
+        r = right.ravel()[idx]
+        keys = np.unique(np.stack([-area[idx], l, i - h + 1, r - l, h], axis=1), axis=0)
+        if len(keys) >= k or pool == n:
+            break
+        pool = min(n, pool * 4)
+
+    return [(int(x) + offset[0], int(y) + offset[1], int(w), int(h)) for _, x, y, w, h in keys[:k]]
+
+
+def add_decimate_arguments(parser):
+    parser.add_argument('--decimate', type=int, default=0, help='search the largest free rectangle on the mask decimated by this factor(4, 8) and push its edges out at full resolution, bounded cost but not always the largest')
+    return parser
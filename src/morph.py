@@ -0,0 +1,120 @@
+import json
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from geometry import gather, group_depth_percentile, measure_gaps
+
+# Morph solver: given the candidate gaps of a frame and the table of the configurations the drone can morph into, finds for every gap the
+# smallest morph which fits through it. The table is sorted by morph amount once, so the answer for all the gaps is a single comparison of
+# gaps x configurations followed by an argmax over the configurations(the first one that fits is the smallest morph).
+
+# Smallest morph fitting one gap:
+# - rect: (x, y, w, h) of the gap in the image
+# - width, height: size of the gap in meters
+# - config: index of the configuration in the table, -1 if none fits
+# - amount: morph amount of that configuration(0 for the unmorphed drone, see MorphSolver), nan if none fits
+MorphFit = namedtuple('MorphFit', ['rect', 'width', 'height', 'config', 'amount'])
+
+
+# Table of configurations of a drone whose width and height can each shrink down to min_scale of their unmorphed size in steps steps, its
+# depth staying the same. The first row is the unmorphed drone
+def morph_configs(width, height, depth, steps=5, min_scale=0.5):
+    scales = np.linspace(1.0, min_scale, steps)
+    sw, sh = np.meshgrid(scales, scales, indexing='ij')
+    return np.column_stack([width * sw.ravel(), height * sh.ravel(), np.full(sw.size, depth)])
+
+
+# Table of configurations from a JSON file: a list of [width, height, depth] or [width, height, depth, amount] rows in meters
+def load_morph_configs(path):
+    with open(path) as f:
+        return np.array(json.load(f), dtype=np.float64)
+
+
+class MorphSolver:
+    # - configs: one row per configuration, width, height and depth in meters, optionally followed by its morph amount. Without it the amount is
+    #   the fraction of the cross-section(width x height) of the first row, the unmorphed drone, that the configuration saves
+    # - margin: clearance(meters) required between the drone and each side of the gap
+    def __init__(self, configs, margin=0.0):
+        configs = np.asarray(configs, dtype=np.float64)
+        if configs.shape[1] > 3:
+            amounts = configs[:, 3]
+        else:
+            amounts = 1 - configs[:, 0] * configs[:, 1] / (configs[0, 0] * configs[0, 1])
+        self.order = np.argsort(amounts, kind='stable')
+        self.widths, self.heights, self.depths = configs[self.order, :3].T
+        self.amounts = amounts[self.order]
+        self.margin = margin
+
+    # For gaps of the given widths and heights(and depths, the free length along the flight direction behind each gap), returns the index in
+    # the table of the smallest configuration which fits each gap(-1 if none does) and its morph amount(nan). Gaps of unmeasured(nan) width or
+    # height fit nothing, an unmeasured depth does not restrict the configurations
+    def solve(self, widths, heights, depths=None):
+        widths = np.asarray(widths, dtype=np.float64)[:, None] - 2 * self.margin
+        heights = np.asarray(heights, dtype=np.float64)[:, None] - 2 * self.margin
+        fits = (self.widths < widths) & (self.heights < heights)
+        if depths is not None:
+            fits &= ~(self.depths > np.asarray(depths, dtype=np.float64)[:, None])
+        first = fits.argmax(axis=1)
+        found = fits[np.arange(len(fits)), first]
+        return np.where(found, self.order[first], -1), np.where(found, self.amounts[first], np.nan)
+
+    # MorphFit of every gap, rects being their (x, y, w, h) in the image
+    def fit(self, rects, widths, heights, depths=None):
+        configs, amounts = self.solve(widths, heights, depths)
+        return [MorphFit(tuple(int(v) for v in rect), float(w), float(h), int(c), float(a))
+                for rect, w, h, c, a in zip(rects, widths, heights, configs, amounts)]
+
+    # MorphFit of every candidate gap of a frame, the selected gap(rect, its measured size gap, see geometry.measure_gap) first. The
+    # candidates are the bounding rectangles of all the contours of mask, the background(depth beyond far_threshold) of the ROI whose
+    # top-left corner is offset, in this frame whatever window the gap itself was searched in; the one overlapping rect most is the selected
+    # gap. The other candidates are measured like the selected one, all at once, and the depth of every gap is its free length(see
+    # free_lengths). A gap is nearer than far_threshold, so a candidate smaller in pixels than the smallest configuration would be at that
+    # distance(e.g. the specks of depth noise) is left out
+    def fit_candidates(self, depth_image, depth_scale, mask, offset, rect, gap, rays, far_threshold):
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+        candidates = np.array([cv2.boundingRect(contour) for contour in contours], dtype=np.int64).reshape(-1, 4)
+        far = far_threshold * depth_scale
+        min_w = (self.widths.min() + 2 * self.margin) * rays.intrinsics.fx / far
+        min_h = (self.heights.min() + 2 * self.margin) * rays.intrinsics.fy / far
+        candidates = candidates[(candidates[:, 2] >= min_w) & (candidates[:, 3] >= min_h)]
+        x, y, w, h = rect
+        overlap = (np.clip(np.minimum(candidates[:, 0] + candidates[:, 2], x + w) - np.maximum(candidates[:, 0], x), 0, None) *
+                   np.clip(np.minimum(candidates[:, 1] + candidates[:, 3], y + h) - np.maximum(candidates[:, 1], y), 0, None))
+        if overlap.size and overlap.max() > 0:
+            candidates = np.delete(candidates, overlap.argmax(), axis=0)
+
+        gaps = [gap] + measure_gaps(depth_image, candidates, rays, depth_scale)
+        rects = np.vstack([np.array(rect, dtype=np.int64).reshape(1, 4), candidates])
+        widths, heights, distances = np.array([(g.width, g.height, g.distance) for g in gaps]).T
+        return self.fit(rects, widths, heights, free_lengths(depth_image, rects, distances, depth_scale, far_threshold))
+
+
+# Free length(meters) along the flight direction behind the gaps at distances meters seen as rects = (x, y, w, h): up to the nearest
+# background(5th percentile of the depths beyond far_threshold, over every step-th pixel of every step-th row) within each rectangle. nan if
+# there is no background in a rectangle or no obstacle around it(it is not nearer than far_threshold, e.g. the whole ROI is free), its free
+# length is unknown then
+def free_lengths(depth_image, rects, distances, depth_scale, far_threshold, step=4):
+    rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+    x, y, w, h = rects.T
+    label, row, col = gather(np.column_stack([y, y + h, x, x + w]), step)
+    z = depth_image[row, col]
+    far = z > far_threshold
+    nearest = group_depth_percentile(z[far], label[far], len(rects), 5) * depth_scale
+    distances = np.asarray(distances, dtype=np.float64)
+    return np.where(distances < far_threshold * depth_scale, nearest - distances, np.nan)
+
+
+def add_morph_arguments(parser):
+    parser.add_argument('--morph', action='store_true', help='find the smallest morph of the drone fitting each candidate gap')
+    parser.add_argument('--morph-table', default=None, help='JSON file of the morph configurations([width, height, depth] rows in meters, the depth is checked against the free length behind each gap), implies --morph')
+    return parser
+
+
+# The morph option of the Detectors: None if disabled, True for the default table built from the drone dimensions, or the table loaded from
+# --morph-table
+def open_morph(args):
+    if args.morph_table:
+        return load_morph_configs(args.morph_table)
+    return True if args.morph else None
@@ -0,0 +1,191 @@
+import time
+import threading
+from collections import deque, namedtuple
+
+import cv2
+
+from instrument import NULL_TIMER
+
+# A frame on its way through the pipeline: the frame, the output of the processing and the host time(time.perf_counter(), in seconds) at which
+# it was captured and processed. frame.timestamp keeps the camera timestamp
+Stamped = namedtuple('Stamped', ['frame', 'output', 'captured_at', 'processed_at'])
+
+
+class Closed(Exception):
+    pass
+
+
+class LatestQueue:
+    # Bounded queue which drops the oldest item when it is full, so that the consumer always gets the newest frame instead of a stale backlog
+    def __init__(self, maxsize=1):
+        self.items = deque(maxlen=maxsize)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0 # number of items overwritten before anyone got them
+
+    # Returns True if an item was dropped to make room
+    def put(self, item):
+        with self.cond:
+            full = len(self.items) == self.items.maxlen
+            if full:
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+            return full
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            if not self.items:
+                raise Closed()
+            return self.items.popleft()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+# Consumer which prints the messages describe(decision) returns(tuples of print arguments) and shows the images drawn by the detector, like
+# the scripts used to do at the end of every iteration. The decision is also passed on to the sink if there is one. The processing must
+# return (decision, images). Returns False when 'q' is pressed to stop the pipeline. close() destroys the windows, highgui is only touched
+# once an image was shown(headless OpenCV builds have no highgui at all)
+class Display:
+    def __init__(self, describe, sink=None):
+        self.describe = describe
+        self.sink = sink
+        self.shown = False
+
+    def __call__(self, stamped):
+        decision, images = stamped.output
+        if self.sink is not None:
+            self.sink.put(decision)
+        for message in self.describe(decision):
+            print(*message)
+        for name, image in images.items():
+            cv2.imshow(name, image)
+            self.shown = True
+
+        # Break the loop if 'q' is pressed
+        return not (self.shown and cv2.waitKey(1) & 0xFF == ord('q'))
+
+    def close(self):
+        if self.shown:
+            cv2.destroyAllWindows()
+
+
+def make_display(describe, sink=None):
+    return Display(describe, sink)
+
+
+# Closes the consumer once the loop is over if it has anything to close(the Display's windows)
+def close_consumer(consumer):
+    close = getattr(consumer, 'close', None)
+    if close is not None:
+        close()
+
+
+# Metrics of a frame whose processing just ended(see instrument.py): the latency from the moment the frame was read to the decision, the age of
+# the frame at the decision according to its camera timestamp(the RealSense timestamps are in the host clock domain, so this includes the time
+# spent in the camera and the driver; meaningless when replaying a recording) and the frames the camera skipped since the previous one
+def observe_frame(metrics, frame, processed_at, previous):
+    metrics.observe('latency_ms', (processed_at - frame.received_at) * 1000)
+    metrics.observe('frame_age_ms', time.time() * 1000 - frame.timestamp)
+    if previous is not None and frame.frame_number > previous + 1:
+        metrics.count('missed_frames', frame.frame_number - previous - 1)
+    return frame.frame_number
+
+
+# Runs capture, processing and display one after the other in the calling thread, the way the scripts did originally. Every frame is processed,
+# which is what offline replay of a recording needs. The source is already started(see frame_source.start_source) and is stopped at the end
+def run_serial(source, process, consumer=None, metrics=NULL_TIMER):
+    previous = None
+    try:
+        for frame in source:
+            if frame is None:
+                metrics.count('skipped_frames') # the camera returned no coherent pair of frames
+                continue
+            captured_at = time.perf_counter()
+            output = process(frame)
+            processed_at = time.perf_counter()
+            previous = observe_frame(metrics, frame, processed_at, previous)
+            if consumer is not None and consumer(Stamped(frame, output, captured_at, processed_at)) is False:
+                break
+    finally:
+        source.stop()
+        close_consumer(consumer)
+
+
+# Runs capture and processing in their own threads, connected by drop-oldest queues. The processing always works on the newest frame and a
+# slow display never delays the next capture. The consumer(display/telemetry) runs in the calling thread since the OpenCV windows need it.
+# Returns the capture and result queues so the callers can look at the number of dropped frames. The source is already started and is stopped
+# at the end
+def run_pipeline(source, process, consumer=None, queue_size=1, metrics=NULL_TIMER):
+    frames = LatestQueue(queue_size)
+    results = LatestQueue(queue_size)
+    stop = threading.Event()
+
+    def capture():
+        try:
+            for frame in source:
+                if stop.is_set():
+                    break
+                if frame is None:
+                    metrics.count('skipped_frames')
+                elif frames.put((frame, time.perf_counter())):
+                    metrics.count('dropped_frames') # replaced by a newer frame before the processing got to it
+        finally:
+            frames.close()
+
+    def work():
+        previous = None
+        try:
+            while not stop.is_set():
+                item = frames.get(timeout=0.1)
+                if item is None:
+                    continue
+                frame, captured_at = item
+                output = process(frame)
+                processed_at = time.perf_counter()
+                previous = observe_frame(metrics, frame, processed_at, previous)
+                if results.put(Stamped(frame, output, captured_at, processed_at)):
+                    metrics.count('dropped_results') # a decision the display never showed
+        except Closed:
+            pass
+        finally:
+            results.close()
+
+    threads = [threading.Thread(target=capture, name='capture', daemon=True),
+               threading.Thread(target=work, name='process', daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            try:
+                stamped = results.get(timeout=0.1)
+            except Closed:
+                break
+            if stamped is not None and consumer is not None and consumer(stamped) is False:
+                break
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        source.stop()
+        close_consumer(consumer)
+
+    return frames, results
+
+
+def add_pipeline_arguments(parser):
+    parser.add_argument('--serial', action='store_true', help='capture, process and display one after the other, processing every frame(offline replay)')
+    return parser
+
+
+def run(args, source, process, consumer=None, metrics=NULL_TIMER):
+    if args.serial:
+        run_serial(source, process, consumer, metrics=metrics)
+        return None
+    return run_pipeline(source, process, consumer, metrics=metrics)
@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+
+# Coarse-to-fine gap search: the gap is first searched on a decimated depth image, then only the window around the winning candidate is
+# searched again at full resolution. The cost of the full resolution pass depends on the size of the gap, not on the size of the image.
+# This is a heuristic: the window is chosen by the coarse pass, so when another gap is the largest one at full resolution but not on the
+# pooled image(e.g. one narrower than two blocks) it is not found.
+
+
+# Min pooling of a z16 depth image over factor x factor blocks, so that an obstacle(the nearest depth of a block) is never lost.
+# Invalid pixels(0) are the minimum as well, a block with one is invalid: the free masks of all the detectors treat invalid pixels as not
+# free, so a pooled pixel is free only if every pixel of its block is free at full resolution
+def min_pool(depth_image, factor):
+    H, W = depth_image.shape
+    h, w = H // factor, W // factor
+    eroded = cv2.erode(depth_image, np.ones((factor, factor), np.uint8), borderType=cv2.BORDER_REPLICATE)
+    return eroded[factor//2::factor, factor//2::factor][:h, :w]
+
+
+# Searches the gap in depth_image(usually the ROI slice of the depth image) on the min pooled image first and refines it at full resolution:
+# - free_mask(depth) returns the uint8 mask of the free pixels(e.g. background) of a depth image
+# - select(mask, offset, depth) returns the gap found in a mask(a contour, a rectangle...) in the coordinates of the mask shifted by offset, or None.
+#   depth is the depth image the mask was computed from
+# - bounds(gap) returns the bounding rectangle (x, y, w, h) of a gap
+# free_mask must not count invalid(0) depths as free, as min_pool does not. Min pooling then only shrinks the free regions, by less than one
+# block on every side around the blocked pixels, so the full resolution window, the coarse bounding rectangle grown by one block, holds the
+# whole free region the coarse gap is part of(but not the other regions, see above). Returns the gap in depth_image coordinates shifted by offset, None if there is none
+def coarse_to_fine(depth_image, factor, free_mask, select, bounds=cv2.boundingRect, offset=(0, 0)):
+    H, W = depth_image.shape
+    pooled = min_pool(depth_image, factor)
+    coarse = select(free_mask(pooled), (0, 0), pooled)
+    if coarse is None:
+        return None
+
+    x, y, w, h = bounds(coarse)
+    x1, y1 = max((x - 1) * factor, 0), max((y - 1) * factor, 0)
+    x2, y2 = min((x + w + 1) * factor, W), min((y + h + 1) * factor, H)
+    window = depth_image[y1:y2, x1:x2]
+    return select(free_mask(window), (offset[0] + x1, offset[1] + y1), window)
+
+
+def add_pyramid_arguments(parser):
+    parser.add_argument('--pyramid', type=int, default=0, help='search the gap on the depth image decimated by this factor(4, 8) first and refine it at full resolution')
+    return parser
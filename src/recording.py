@@ -0,0 +1,249 @@
+import json
+import os
+import queue
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+from frame_source import SCENE_KINDS, EndOfStream, Frame, FrameSource, GapTruth, Intrinsics
+
+# Recording format for offline replay of the frames the scripts pull(z16 depth, bgr8 color, timestamps, intrinsics), in a directory:
+# - meta.json: intrinsics, depth scale, image size, chunk size, compression and number of frames
+# - depth_NNNNN.npy / color_NNNNN.npy: chunk_size frames each, stacked in plain .npy arrays which the reader memory-maps, so a depth image
+#   is a zero-copy view into the file and any frame can be read without decoding the ones before it
+# - chunk_NNNNN.npz instead of the two .npy files if the recording is compressed(smaller but each chunk must be decompressed to be read)
+# - index_NNNNN.npy: one record per frame of the chunk(frame number, camera timestamp and the ground truth of synthetic frames)
+# Every chunk is written with its own index, then meta.json is rewritten with the new number of frames, so writing a chunk costs the same
+# however long the recording is and a recording cut short still holds every complete chunk.
+
+INDEX_DTYPE = np.dtype([
+    ('frame_number', np.int64),
+    ('timestamp', np.float64), # camera timestamp in milliseconds
+    ('gap_kind', np.int8), # index in SCENE_KINDS of the synthetic scene, -1 if the frame has no ground truth
+    ('gap_size', np.float32, (3,)), # width, height and distance of the gap in meters
+    ('gap_rect', np.int32, (4,)), # (x, y, w, h) of the gap in pixels, -1s if it isn't visible
+])
+
+
+def index_file(path, chunk):
+    return os.path.join(path, 'index_%05d.npy' % chunk)
+
+
+def chunk_files(path, chunk, compress):
+    if compress:
+        return os.path.join(path, 'chunk_%05d.npz' % chunk),
+    return os.path.join(path, 'depth_%05d.npy' % chunk), os.path.join(path, 'color_%05d.npy' % chunk)
+
+
+class Recorder:
+    # Writes frames to a recording directory. write() only copies the frame into the current chunk, full chunks are written to disk by a
+    # background thread. If the disk can't keep up, write() blocks once max_pending chunks are waiting rather than dropping frames
+    def __init__(self, path, intrinsics, depth_scale=0.001, chunk_size=30, compress=False, max_pending=2):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.intrinsics = intrinsics
+        self.depth_scale = depth_scale
+        self.chunk_size = chunk_size
+        self.compress = compress
+
+        self.index = [] # records of the current chunk
+        self.depth = self.color = None
+        self.filled = 0 # frames in the current chunk
+        self.chunks = 0 # chunks handed to the writer
+        self.frames = 0 # frames handed to the writer
+
+        self.pending = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self.run, name='recorder', daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        if self.depth is None:
+            # Allocated on the first frame, the buffers of a full chunk go to the writer and new ones are allocated
+            self.depth = np.empty((self.chunk_size,) + frame.depth_image.shape, frame.depth_image.dtype)
+            self.color = np.empty((self.chunk_size,) + frame.color_image.shape, frame.color_image.dtype)
+        self.depth[self.filled] = frame.depth_image
+        self.color[self.filled] = frame.color_image
+        self.index.append(index_record(frame))
+        self.filled += 1
+        if self.filled == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.filled == 0:
+            return
+        self.frames += self.filled
+        self.pending.put((self.chunks, self.depth[:self.filled], self.color[:self.filled], np.array(self.index, dtype=INDEX_DTYPE), self.frames))
+        self.chunks += 1
+        self.index = []
+        self.depth = self.color = None
+        self.filled = 0
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            chunk, depth, color, index, num_frames = item
+            files = chunk_files(self.path, chunk, self.compress)
+            if self.compress:
+                # Same layout as np.savez_compressed but at the fastest deflate level, the default one can't keep up with the camera
+                with zipfile.ZipFile(files[0], 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+                    for name, array in (('depth', depth), ('color', color)):
+                        with archive.open(name + '.npy', 'w', force_zip64=True) as f:
+                            np.lib.format.write_array(f, array)
+            else:
+                np.save(files[0], depth)
+                np.save(files[1], color)
+            np.save(index_file(self.path, chunk), index)
+            self.write_meta(num_frames, depth.shape[1:], color.shape[1:])
+
+    def write_meta(self, num_frames, depth_shape, color_shape):
+        meta = dict(intrinsics=self.intrinsics._asdict() if self.intrinsics is not None else None, depth_scale=self.depth_scale,
+                    depth_shape=list(depth_shape), color_shape=list(color_shape), chunk_size=self.chunk_size, compress=self.compress,
+                    num_frames=num_frames)
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
+
+
+def index_record(frame):
+    gap = frame.gap
+    if gap is None:
+        return (frame.frame_number, frame.timestamp, -1, (np.nan,) * 3, (-1,) * 4)
+    return (frame.frame_number, frame.timestamp, SCENE_KINDS.index(gap.kind), (gap.width, gap.height, gap.distance), gap.rect or (-1,) * 4)
+
+
+class Recording:
+    # Random access to a recording: recording[i] is the i-th Frame. The last cached_chunks chunks stay mapped(or decompressed) read-only, the
+    # depth image is a read-only view into its chunk and the color image a copy the caller may draw on(as the scripts do), so reading a frame
+    # again always gives the recorded images
+    def __init__(self, path, cached_chunks=8):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.path = path
+        self.intrinsics = Intrinsics(**meta['intrinsics']) if meta['intrinsics'] is not None else None
+        self.depth_scale = meta['depth_scale']
+        self.chunk_size = meta['chunk_size']
+        self.compress = meta['compress']
+        chunks = -(-meta['num_frames'] // self.chunk_size)
+        self.index = np.concatenate([np.load(index_file(path, chunk)) for chunk in range(chunks)] or
+                                    [np.empty(0, dtype=INDEX_DTYPE)])[:meta['num_frames']]
+        self.chunks = OrderedDict() # chunk number -> (depth, color), least recently used first
+        self.cached_chunks = cached_chunks
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def load_chunk(self, chunk):
+        with self.lock:
+            if chunk in self.chunks:
+                self.chunks.move_to_end(chunk)
+                return self.chunks[chunk]
+            files = chunk_files(self.path, chunk, self.compress)
+            if self.compress:
+                with np.load(files[0]) as data:
+                    arrays = data['depth'], data['color']
+                for array in arrays:
+                    array.flags.writeable = False
+            else:
+                arrays = np.load(files[0], mmap_mode='r'), np.load(files[1], mmap_mode='r')
+            self.chunks[chunk] = arrays
+            if len(self.chunks) > self.cached_chunks:
+                self.chunks.popitem(last=False)
+            return arrays
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        depth, color = self.load_chunk(i // self.chunk_size)
+        record = self.index[i]
+        gap = None
+        if record['gap_kind'] >= 0:
+            rect = tuple(int(v) for v in record['gap_rect'])
+            gap = GapTruth(SCENE_KINDS[record['gap_kind']], *(float(v) for v in record['gap_size']), rect if rect[2] > 0 else None)
+        return Frame(depth[i % self.chunk_size], color[i % self.chunk_size].copy(), float(record['timestamp']), int(record['frame_number']),
+                     self.depth_scale, gap)
+
+    # Position of the frame with the given frame number, or of the last frame taken at or before a camera timestamp(ms)
+    def find_frame(self, frame_number):
+        i = int(np.searchsorted(self.index['frame_number'], frame_number))
+        if i == len(self) or self.index['frame_number'][i] != frame_number:
+            raise KeyError(frame_number)
+        return i
+
+    def find_time(self, timestamp):
+        return max(int(np.searchsorted(self.index['timestamp'], timestamp, side='right')) - 1, 0)
+
+
+class RecordedSource(FrameSource):
+    # Replays a recording(frames start..stop-1) as fast as the frames can be read, or at the pace they were recorded if real_time is set
+    def __init__(self, path, start=0, stop=None, real_time=False):
+        self.recording = Recording(path)
+        self.intrinsics = self.recording.intrinsics
+        self.depth_scale = self.recording.depth_scale
+        self.start_at = start
+        self.stop_at = len(self.recording) if stop is None else min(stop, len(self.recording))
+        self.real_time = real_time
+        self.position = start
+        self.clock = None
+
+    def read(self):
+        if self.position >= self.stop_at:
+            raise EndOfStream()
+        frame = self.recording[self.position]
+        self.position += 1
+
+        if self.real_time:
+            # Wait until as much time passed since the first frame as between the recorded timestamps
+            if self.clock is None:
+                self.clock = (time.perf_counter(), frame.timestamp)
+            delay = (frame.timestamp - self.clock[1]) / 1000 - (time.perf_counter() - self.clock[0])
+            if delay > 0:
+                time.sleep(delay)
+            frame.received_at = time.perf_counter()
+        return frame
+
+
+class TeeSource(FrameSource):
+    # Passes the frames of another source through and records them
+    def __init__(self, source, path, chunk_size=30, compress=False):
+        self.source = source
+        self.path = path
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.recorder = None
+
+    def start(self):
+        self.source.start()
+        self.intrinsics = self.source.intrinsics
+        self.depth_scale = self.source.depth_scale
+        self.recorder = Recorder(self.path, self.intrinsics, self.depth_scale, self.chunk_size, self.compress)
+
+    def stop(self):
+        self.source.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def read(self):
+        frame = self.source.read()
+        if frame is not None:
+            self.recorder.write(frame)
+        return frame
+
+
+# True if path is a recording directory
+def is_recording(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
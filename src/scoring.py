@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+
+# Depth weighted scoring of candidate gaps. Picking the contour with the largest area prefers a large wall just beyond the far threshold over
+# a smaller doorway with the open space behind it; weighting the area by the depth seen through the candidate(and by the fraction of it with
+# a valid depth) prefers the doorway. The sums are read from integral images(summed-area tables) of the depth and of the validity, so the
+# cost of scoring a candidate rectangle is the same whatever its size and any number of candidates can be scored in one vectorized step.
+
+
+class DepthScorer:
+    # - depth_scale converts the depth units to meters, the detectors set it from every frame(Frame.depth_scale) before scoring
+    # - the score of a rectangle is area * mean_depth**depth_weight * valid_fraction**valid_weight, mean_depth being the mean of its valid depths
+    #   in meters(each valid depth clipped to max_depth meters, so a few far outliers can't make up for a small area)
+    def __init__(self, depth_scale=None, depth_weight=1.0, valid_weight=1.0, max_depth=10.0):
+        self.depth_scale = depth_scale
+        self.depth_weight = depth_weight
+        self.valid_weight = valid_weight
+        self.max_depth = max_depth
+
+    # Integral images of the clipped depth and of the validity of a depth image: entry [y, x] is the sum over the pixels above and to the left
+    def integrals(self, depth_image):
+        depth = np.minimum(depth_image, np.uint16(min(self.max_depth / self.depth_scale, 65535)))
+        depth_sum = cv2.integral(depth, sdepth=cv2.CV_64F)
+        valid_count = cv2.integral((depth_image > 0).view(np.uint8))
+        return depth_sum, valid_count
+
+    # Scores of the rectangles(N x 4 array of (x, y, w, h) in the coordinates of depth_image). areas replaces w*h as the area of each candidate,
+    # e.g. with the areas of the contours the rectangles bound
+    def score(self, depth_image, rects, areas=None):
+        rects = np.asarray(rects, dtype=np.intp).reshape(-1, 4)
+        depth_sum, valid_count = self.integrals(depth_image)
+
+        x1, y1 = rects[:, 0], rects[:, 1]
+        x2, y2 = x1 + rects[:, 2], y1 + rects[:, 3]
+
+        def box_sum(integral):
+            return integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+
+        box = (rects[:, 2] * rects[:, 3]).astype(np.float64)
+        valid = box_sum(valid_count).astype(np.float64)
+        mean_depth = box_sum(depth_sum) * self.depth_scale / np.maximum(valid, 1)
+        if areas is None:
+            areas = box
+        return np.asarray(areas, dtype=np.float64) * mean_depth**self.depth_weight * (valid / np.maximum(box, 1))**self.valid_weight
+
+    # Index of the best of the rectangles, None if there are none
+    def best(self, depth_image, rects, areas=None):
+        if len(rects) == 0:
+            return None
+        return int(np.argmax(self.score(depth_image, rects, areas)))
+
+
+def add_scoring_arguments(parser):
+    parser.add_argument('--score', action='store_true', help='pick the gap whose area weighted by its depth and fraction of valid pixels is the largest, instead of the largest area')
+    return parser
@@ -0,0 +1,94 @@
+from collections import namedtuple
+
+import numpy as np
+
+from max_rect import largest_empty_rects
+from pyramid import min_pool
+
+# Multi-plane gap sweep: instead of checking a single distance(1 m in test1, 2 m in test2), the depth image is thresholded at N distance planes
+# at once and the passable gaps of every plane are found in the same whole-array operations, the planes being a leading batch axis. The work
+# is done on the min pooled depth image(see pyramid.py) so that a 16 plane sweep stays within a frame period.
+
+# What the sweep found at one distance plane:
+# - distance: distance of the plane in meters
+# - footprint: (w, h) of the drone seen at that distance, in pixels
+# - rect: (x, y, w, h) largest rectangle with no obstacle closer than the plane plus the drone's depth, None if there is none
+# - window: (x, y, w, h) obstacle free window of the size of the footprint which is the closest to the image center, None if the drone can't
+#   pass at that distance
+PlaneGap = namedtuple('PlaneGap', ['distance', 'footprint', 'rect', 'window'])
+
+
+# Size (w, h) in pixels of a width x height(meters) object seen at each of the distances(meters), rounded up
+def footprint_table(intrinsics, distances, width, height):
+    distances = np.asarray(distances, dtype=np.float64)
+    return np.ceil(intrinsics.fx * width / distances).astype(np.intp), np.ceil(intrinsics.fy * height / distances).astype(np.intp)
+
+
+class PlaneSweep:
+    # - distances: the planes(meters), e.g. np.linspace(0.6, 4.0, 16)
+    # - drone_width, drone_height, drone_depth: drone dimensions(meters). A pixel is free at a plane if nothing is closer than the plane plus the
+    #   drone's depth, as in test1
+    # - factor: min pooling factor. An invalid(0) depth pools to an invalid block and is below every threshold, so a pooled pixel is free
+    #   only if every pixel of its block has a valid depth beyond the plane and every result holds at full resolution(the free regions lose
+    #   less than a block on every side of the obstacles and of the invalid pixels)
+    def __init__(self, intrinsics, distances, drone_width, drone_height, drone_depth, factor=8):
+        self.intrinsics = intrinsics
+        self.distances = np.asarray(distances, dtype=np.float64)
+        self.drone_depth = drone_depth
+        self.factor = factor
+
+        # Footprints in full resolution pixels and in pooled pixels(enough blocks to cover it)
+        self.footprints = np.stack(footprint_table(intrinsics, self.distances, drone_width, drone_height), axis=-1)
+        fw, fh = (-(-self.footprints // factor)).T
+
+        # Flat indices reading the box sums of the footprint at every pooled position of every plane out of the integral images, and the squared
+        # distance between the center of the footprint and the image center(infinite where the footprint leaves the image)
+        n = len(self.distances)
+        h, w = intrinsics.height // factor, intrinsics.width // factor
+        y = np.arange(h)[None, :, None]
+        x = np.arange(w)[None, None, :]
+        fw3, fh3 = fw[:, None, None], fh[:, None, None]
+        y2, x2 = np.minimum(y + fh3, h), np.minimum(x + fw3, w)
+        base = np.arange(n)[:, None, None] * (h + 1) * (w + 1)
+        self.corners = [(base + r * (w + 1) + c).ravel() for r, c in ((y2, x2), (y, x2), (y2, x), (y, x))]
+        cx, cy = intrinsics.cx / factor, intrinsics.cy / factor
+        inside = (y + fh3 <= h) & (x + fw3 <= w)
+        self.center_distance = np.where(inside, (x + fw3 / 2 - cx)**2 + (y + fh3 / 2 - cy)**2, np.inf).reshape(n, -1)
+        self.fw, self.fh = fw, fh
+
+    # Sweeps all the planes over a depth image(depth_scale meters per unit, Frame.depth_scale), returns one PlaneGap per plane
+    def sweep(self, depth_image, depth_scale):
+        f = self.factor
+        thresholds = np.minimum(np.round((self.distances + self.drone_depth) / depth_scale), 65535).astype(np.uint16)[:, None, None]
+        pooled = min_pool(depth_image, f)
+        free = pooled[None] >= thresholds # planes x h x w
+
+        # Largest empty rectangle of every plane in one batched pass
+        rects, areas = largest_empty_rects(free)
+
+        # Number of obstacle pixels under the footprint at every position, from the integral images of the obstacles of every plane
+        n, h, w = free.shape
+        integral = np.zeros((n, h + 1, w + 1), dtype=np.int32)
+        np.cumsum(np.cumsum(~free, axis=1, dtype=np.int32), axis=2, out=integral[:, 1:, 1:])
+        a, b, c, d = (integral.take(corner) for corner in self.corners)
+        blocked = a - b - c + d
+
+        # The free footprint position closest to the image center, per plane
+        cost = np.where(blocked.reshape(n, -1) == 0, self.center_distance, np.inf)
+        best = np.argmin(cost, axis=1)
+        passable = np.isfinite(cost[np.arange(n), best])
+
+        gaps = []
+        for i in range(n):
+            rect = tuple(int(v) * f for v in rects[i]) if areas[i] > 0 else None
+            window = None
+            if passable[i]:
+                wy, wx = divmod(int(best[i]), w)
+                window = (wx * f, wy * f, int(self.fw[i]) * f, int(self.fh[i]) * f)
+            gaps.append(PlaneGap(float(self.distances[i]), tuple(int(v) for v in self.footprints[i]), rect, window))
+        return gaps
+
+
+def add_sweep_arguments(parser):
+    parser.add_argument('--sweep', type=int, default=0, help='also report the passable gaps at this many distance planes(test1: between 0.6 and 4 m)')
+    return parser
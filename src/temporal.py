@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+
+from frame_source import Frame, FrameSource
+
+# Temporal depth filter. The last N depth images are kept per pixel in a preallocated buffer sorted along the window axis, invalid(0) depths
+# sorting first. Every new frame replaces the oldest depth of every pixel: the old value is taken out of the sorted column and the new one is
+# merged in with a few whole-image min/max operations, so the cost per frame grows with N but nothing is re-sorted or re-scanned. The median
+# (or minimum) of the valid depths of every pixel is then read at an index given by its number of valid depths. Pixels with no valid depth
+# in the whole window are filled with the closest valid depth around them.
+
+FILTER_MODES = ('median', 'min')
+
+
+class TemporalFilter:
+    # - window: number of frames N kept
+    # - mode: 'median' of the valid depths of the window(the lower one if their number is even, i.e. the closer) or 'min', the closest depth
+    #   seen, which never lets an obstacle seen on one frame out of N disappear
+    # - fill: size in pixels of the neighbourhood holes are filled from(0 disables it). A hole takes the closest valid depth of the
+    #   neighbourhood, so filling can make an obstacle grow but never make it shrink
+    def __init__(self, window=5, mode='median', fill=5):
+        if mode not in FILTER_MODES:
+            raise ValueError('Unknown filter mode: ' + mode)
+        self.window = window
+        self.mode = mode
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (fill, fill)) if fill > 1 else None
+        self.shape = None
+
+    # Buffers are allocated on the first frame, every one of its pixels invalid
+    def allocate(self, shape):
+        n, p = self.window, int(np.prod(shape))
+        self.shape = shape
+        self.ring = np.zeros((n, p), dtype=np.uint16) # depths in arrival order, ring[self.slot] is the oldest
+        self.sorted = np.zeros((n, p), dtype=np.uint16) # the same depths sorted per pixel
+        self.removed = np.empty((n - 1, p), dtype=np.uint16) # sorted depths without the oldest one
+        self.above = np.empty(p, dtype=bool)
+        self.step = np.empty(p, dtype=np.uint16)
+        self.valid = np.zeros(p, dtype=np.int16) # number of valid depths per pixel
+        self.columns = np.arange(p)
+        self.flat = np.empty(p, dtype=np.intp)
+        self.slot = 0
+
+        # Row of the result in the sorted buffer for every number of valid depths v: the valid depths of a pixel are the last v of its
+        # sorted column(v = 0 reads an invalid 0)
+        v = np.maximum(np.arange(n + 1), 1)
+        rows = n - v + ((v - 1) // 2 if self.mode == 'median' else 0)
+        self.rows = rows.astype(np.intp) * p
+
+    def update(self, depth_image):
+        if depth_image.shape != self.shape:
+            self.allocate(depth_image.shape)
+        n, s, r = self.window, self.sorted, self.removed
+        new = depth_image.reshape(-1)
+        old = self.ring[self.slot]
+
+        # Remove the old value: the values below it stay where they are, the others move one place down. With duplicates of the old value
+        # this removes the first one, which is the same. Written as removed[k] = sorted[k] + (sorted[k+1] - sorted[k]) * (sorted[k] >= old),
+        # several times faster than a masked copy or np.where on random masks
+        for k in range(n - 1):
+            np.greater_equal(s[k], old, out=self.above)
+            np.subtract(s[k + 1], s[k], out=self.step)
+            np.multiply(self.step, self.above, out=self.step)
+            np.add(s[k], self.step, out=r[k])
+
+        # Merge the new value in: sorted[k] = max(removed[k-1], min(removed[k], new))
+        if n == 1:
+            s[0] = new
+        else:
+            np.minimum(r[0], new, out=s[0])
+            for k in range(1, n - 1):
+                np.minimum(r[k], new, out=s[k])
+                np.maximum(s[k], r[k - 1], out=s[k])
+            np.maximum(r[n - 2], new, out=s[n - 1])
+
+        self.valid += (new > 0).view(np.int8)
+        self.valid -= (old > 0).view(np.int8)
+        old[:] = new
+        self.slot = (self.slot + 1) % n
+        return self.result()
+
+    # The filtered depth image(a new array, the buffers are updated in place on the next frame)
+    def result(self):
+        self.rows.take(self.valid, out=self.flat, mode='clip') # valid is always within 0..N, 'clip' only spares a copy of the output
+        self.flat += self.columns
+        depth = self.sorted.take(self.flat).reshape(self.shape)
+
+        holes = depth == 0
+        if self.kernel is not None and holes.any():
+            # Erosion takes the minimum of the neighbourhood, holes are lifted to the maximum depth so that they never win
+            closest = cv2.erode(np.where(holes, np.uint16(65535), depth), self.kernel)
+            closest[closest == 65535] = 0 # nothing valid around either
+            np.copyto(depth, closest, where=holes)
+        return depth
+
+
+class FilteredSource(FrameSource):
+    # Passes the frames of another source through the temporal filter. The frames keep their color image, timestamps and ground truth
+    def __init__(self, source, window=5, mode='median', fill=5):
+        self.source = source
+        self.filter = TemporalFilter(window, mode, fill)
+
+    def start(self):
+        self.source.start()
+        self.intrinsics = self.source.intrinsics
+        self.depth_scale = self.source.depth_scale
+
+    def stop(self):
+        self.source.stop()
+
+    def read(self):
+        frame = self.source.read()
+        if frame is None:
+            return None
+        filtered = Frame(self.filter.update(frame.depth_image), frame.color_image, frame.timestamp, frame.frame_number, frame.depth_scale, frame.gap)
+        filtered.received_at = frame.received_at
+        return filtered
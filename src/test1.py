@@ -1,16 +1,20 @@
+import argparse
+from functools import partial
 import cv2
 import numpy as np
-import pyrealsense2 as rs
 import math
 
-# Configure depth and color streams
-pipeline = rs.pipeline()
-config = rs.config()
-config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
-config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
-
-# Start streaming
-pipeline.start(config)
+from decision import Action, add_decision_arguments, make_decision, open_sink
+from depth_bands import fill_speckles
+from calibration import add_calibration_arguments, calibrated_size, open_calibration
+from frame_source import Intrinsics, add_source_arguments, open_source, scale_intrinsics, start_source
+from geometry import RayTable, measure_gap, missing_reason
+from instrument import NULL_TIMER, add_metrics_arguments, open_metrics
+from max_rect import add_decimate_arguments, largest_empty_rect, largest_empty_rect_decimated
+from pipeline import add_pipeline_arguments, make_display, run
+from pyramid import add_pyramid_arguments, coarse_to_fine
+from sweep import PlaneSweep, add_sweep_arguments
+from voxmap import VoxelMap, add_voxel_arguments
 
 # Camera Intrinsics
 fx, fy, cx, cy = 6.0970550296798035e+02, 6.0909579671294716e+02, 3.1916667152289227e+02, 2.3558360480225772e+02
@@ -23,100 +27,205 @@ drone_dim_top_view = 0.6 #drone's third dimension
 # The dimensions of the bounding box. This bounding box is taken in such a way that if the drone is present in front of camera at a distance of 1m(where we are checking if there is any gap or not), it can pass through this bounding box
 roi_im_b = 365 #the bredth of the ROI(rectangle)
 roi_im_h = 274 #the height of the ROI
+roi_distance = 1.0 # distance(in meters) at which the ROI is the drone's size, where a calibration file is read
+
+# Range of the distance planes checked by the multi-plane sweep(in meters)
+sweep_near = 0.6
+sweep_far = 4.0
+
+# Pixels closer than this(in millimeters) are obstacles. drone_dim_top_view is added so as to make sure that the drone can completely pass through the gap
+near_threshold = 1000 + drone_dim_top_view*1000
+
+# Distance(in meters) the drone's corridor is checked over in the voxel map when no gap could be measured: up to the plane checked in the image
+corridor_length = 1 + drone_dim_top_view
+
+
+# Largest rectangle(x, y, w, h) within a mask of the free pixels, shifted by offset. depth is not needed: the rectangle contains no obstacle pixel
+# whatever the depth behind it
+def select_gap(mask, offset=(0, 0), depth=None):
+    return largest_empty_rect(mask, offset)
+
+
+class Detector:
+    # The detection logic run on every frame. detect() returns the decision and, if draw is set, the images to show.
+    # pyramid > 1 searches the gap on the ROI decimated by that factor first and refines it at full resolution. decimate > 1 searches the
+    # largest free rectangle of the mask decimated by that factor and only pushes its edges out at full resolution(see max_rect.py).
+    # sweep > 0 also reports the passable gaps at that many distance planes between sweep_near and sweep_far, over the whole image.
+    # voxels > 0 also keeps a map of the last frames in voxels of that size(meters) and only lets the drone pass if its box can fly through
+    # the gap without meeting any. calibration(see calibration.py) replaces roi_im_b/roi_im_h with the calibrated pixel size of the drone.
+    # timer gets a lap at the end of every stage(see instrument.py)
+    def __init__(self, intrinsics=Intrinsics(640, 480, fx, fy, cx, cy), pyramid=0, decimate=0, sweep=0, voxels=0, calibration=None, timer=NULL_TIMER):
+        self.rays = RayTable(intrinsics) # Direction of the ray through every pixel, computed once
+
+        # The ROI dimensions above are given for the focal lengths above, they are scaled to the resolution actually streamed
+        self.cx, self.cy = intrinsics.cx, intrinsics.cy
+        self.roi_im_b, self.roi_im_h = roi_im_b * intrinsics.fx / fx, roi_im_h * intrinsics.fy / fy
+        if calibration is not None:
+            self.roi_im_b, self.roi_im_h = calibrated_size(calibration, roi_distance, intrinsics)
+        self.pyramid = pyramid
+        self.decimate = decimate
+        self.timer = timer
+        self.sweep = PlaneSweep(intrinsics, np.linspace(sweep_near, sweep_far, sweep), drone_width, drone_height, drone_dim_top_view,
+                                factor=max(round(8 * intrinsics.width / 640), 1)) if sweep > 0 else None
+        self.voxels = VoxelMap(voxels) if voxels > 0 else None
+        stride = max(round(4 * intrinsics.width / 640), 1) # every 4th pixel of every 4th row of the 640x480 stream goes into the map
+        self.voxel_sample = (slice(None, None, stride), slice(None, None, stride))
+
+    # What is printed for a decision
+    def describe(self, decision):
+        messages = []
+        if decision.size is not None:
+            messages.append(("The Gap dimensions as width x height are: ",decision.size[0]," x ",decision.size[1]))
+        if decision.action == Action.PASS:
+            messages.append(("The drone can pass through the gap",))
+        else:
+            messages.append(("The drone cannot pass through the gap",))
+        if decision.reason is not None:
+            messages.append(("The gap could not be measured completely: " + decision.reason,))
+        if decision.corridor is not None:
+            messages.append(("Free corridor ahead: %.2f m out of %.2f m" % (decision.corridor.free, decision.corridor.length),))
+        for plane in decision.planes or []:
+            if plane.window is not None:
+                messages.append(("At %.2f m the drone can pass through the window" % plane.distance, plane.window))
+            else:
+                messages.append(("At %.2f m the drone cannot pass" % plane.distance,))
+        return messages
+
+    def detect(self, frame, draw=False):
+        lap = self.timer.lap
+        self.timer.begin()
+        cx, cy = self.cx, self.cy
+        roi_im_b, roi_im_h = self.roi_im_b, self.roi_im_h
+
+        # The scattered invalid pixels would block the free rectangle everywhere, they take the closest depth around them(larger invalid
+        # regions stay blocked)
+        depth_image = fill_speckles(frame.depth_image)
+        lap('fill')
+
+        # Binary mask of the pixels which are not closer than near_threshold(invalid pixels are not free)
+        def free_mask(depth):
+            return cv2.compare(depth, near_threshold, cv2.CMP_GE)
 
-try:
-    while True:
-        # Wait for a coherent pair of frames
-        frames = pipeline.wait_for_frames()
-        depth_frame = frames.get_depth_frame() 
-        color_frame = frames.get_color_frame()
+        # Find out the top-left and bottom-right coordinates of the ROI
+        roi_x1, roi_y1 = int(cx - roi_im_b/2), int(cy - roi_im_h/2)
+        roi_x2, roi_y2 = int(cx + roi_im_b/2), int(cy + roi_im_h/2)
+
+        # Find the largest rectangle within the ROI that contains no pixel closer than near_threshold(unlike the bounding rectangles of the contours, it never contains an obstacle). It's through this rectangle which we want the drone to pass
+        if self.pyramid > 1:
+            # Search on the min pooled ROI first and refine only the window around the winner at full resolution
+            max_rect = coarse_to_fine(depth_image[roi_y1:roi_y2, roi_x1:roi_x2], self.pyramid, free_mask, select_gap, bounds=lambda rect: rect, offset=(roi_x1, roi_y1))
+            lap('search')
+        else:
+            mask = free_mask(depth_image[roi_y1:roi_y2, roi_x1:roi_x2])
+            lap('mask')
+            if self.decimate > 1:
+                max_rect = largest_empty_rect_decimated(mask, self.decimate, offset=(roi_x1, roi_y1))
+            else:
+                max_rect = select_gap(mask, offset=(roi_x1, roi_y1))
+            lap('select')
+
+        # Passable gaps at every distance plane, all the planes in one pass
+        planes = None
+        if self.sweep is not None:
+            planes = self.sweep.sweep(depth_image, frame.depth_scale)
+            lap('sweep')
+
+        # 3D occupancy of the last frames, from a sample of the depth pixels
+        if self.voxels is not None:
+            self.voxels.update(self.rays.deproject(depth_image, frame.depth_scale, self.voxel_sample))
+            lap('voxels')
+
+        if max_rect is None: # The whole ROI is blocked
+            corridor = self.voxels.corridor(drone_width, drone_height, corridor_length) if self.voxels is not None else None
+            return make_decision(frame, Action.CANNOT_PASS, planes=planes, corridor=corridor), {}
 
-        if not depth_frame or not color_frame:
-            continue
+        x, y, w, h = max_rect
 
-        # Convert depth frame to numpy array
-        depth_image = np.asanyarray(depth_frame.get_data())
+        # Dimensions of the maximum rectangle in 3D, measured on the depth of the obstacle around each of its edges(deprojected in one go with the precomputed rays)
+        gap = measure_gap(depth_image, max_rect, self.rays, frame.depth_scale)
+        lap('measure')
 
-        # Define near threshold (adjust as needed)
-        near_threshold = 1000 + drone_dim_top_view*1000 # This value is in millimeters. Here drone_dim_top_view is added so as to make sure that the drone can completely pass through the gap
+        # Assumption: We assume that all the points in the hole/gap through which the drone is to pass lie on the same plane(gap.residual tells how far they are from it)
+        gap_width = gap.width
+        gap_height = gap.height
 
-        # Create binary mask for pixels at a depth less that near_threshold 
+        if gap_width>drone_width and gap_height>drone_height:
+            action = Action.PASS
+        else:
+            action = Action.CANNOT_PASS
+
+        # The drone's box flying straight through the center of the gap, up to the far side of the drone once it is through, must not meet
+        # any occupied voxel. This does not assume that the gap is planar
+        corridor = None
+        if self.voxels is not None:
+            if math.isnan(gap.distance):
+                corridor = self.voxels.corridor(drone_width, drone_height, corridor_length)
+            else:
+                corridor = self.voxels.corridor(drone_width, drone_height, gap.distance + drone_dim_top_view,
+                                                self.rays.edge_x(x + w/2) * gap.distance, self.rays.edge_y(y + h/2) * gap.distance)
+            if corridor.free < corridor.length:
+                action = Action.CANNOT_PASS
+            lap('corridor')
+
+        # The rectangle contains no obstacle pixel by construction
+        decision = make_decision(frame, action, max_rect, (gap_width, gap_height), 1.0, planes, corridor, reason=missing_reason(gap), plane=(gap.normal, gap.residual))
+
+        if not draw:
+            return decision, {}
+
+        # Create binary mask for pixels at a depth less that near_threshold
         near_mask = np.where(depth_image < near_threshold, 0, 255).astype(np.uint8)
+        lap('near_mask')
 
-        color_image = np.asanyarray(color_frame.get_data())
+        color_image = frame.color_image
         gray_image = cv2.cvtColor(color_image,cv2.COLOR_BGR2GRAY) # Computed to reduce the number of channels and save computation
+        lap('cvtColor')
 
         # Apply the mask to the grayscale image
         near_colored = cv2.bitwise_and(gray_image, gray_image, mask=near_mask)
+        lap('bitwise_and')
 
-        # Draw ROI 
+        # Draw ROI
         cv2.rectangle(near_colored, (int(cx - roi_im_b/2), int(cy - roi_im_h/2)), (int(cx + roi_im_b/2), int(cy + roi_im_h/2)), (255, 0, 0), 2)
 
-        # Find out the top-left and bottom-right coordinates of the ROI
-        roi_x1, roi_y1 = int(cx - roi_im_b/2), int(cy - roi_im_h/2)
-        roi_x2, roi_y2 = int(cx + roi_im_b/2), int(cy + roi_im_h/2)
-
-        # Create a mask which is used to take only the non-zero pixel values within the ROI 
+        # Create a mask which is used to take only the non-zero pixel values within the ROI
         near_mask_within_roi = np.zeros_like(near_mask)
         near_mask_within_roi[roi_y1:roi_y2, roi_x1:roi_x2] = np.where(near_mask[roi_y1:roi_y2, roi_x1:roi_x2] > 0, 255, 0).astype(np.uint8)
 
         # Apply the near_mask_within_roi to the near_colored image
         near_colored_roi = cv2.bitwise_and(near_colored, near_colored, mask=near_mask_within_roi)
 
-        # Find out the contours within the non-zero region in the near_colored_roi
-        contours, _ = cv2.findContours(near_mask_within_roi, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        max_area = 0 # To store the area of rectangle with maximum area in the non-zero region in the near_colored_roi
-        max_rect = None # Used to store coordinates of the max-area rectangle. It's through this rectangle which we want the drone to pass
-
-        for contour in contours: # Iterate over all the contours
-            # Get the bounding rectangle
-            x, y, w, h = cv2.boundingRect(contour) 
-
-            # Calculate the area of the rectangle
-            rect_area = w * h
-
-            # Update max_area and max_rect if the current rectangle has a larger area
-            if rect_area > max_area:
-                max_area = rect_area
-                max_rect = (x, y, w, h)
-
         # Draw the maximum rectangle on the image
-        x, y, w, h = max_rect
-
-        # Coordinates of midpoints of the maximum rectangle in 3D
-        z1 = depth_frame.get_distance(x,int(y+h/2))
-        z2 = depth_frame.get_distance(x+w,int(y+h/2))
-        z3 = depth_frame.get_distance(int(x+w/2),y)
-        z4 = depth_frame.get_distance(int(x+w/2),y+h)
-
-        x1_3d, y1_3d = x*z1/fx, int(y+h/2)*z1/fy
-        x2_3d, y2_3d = (x+w)*z2/fx, int(y+h/2)*z2/fy
-        x3_3d, y3_3d = int(x+w/2)*z3/fx, y*z3/fy
-        x4_3d, y4_3d = int(x+w/2)*z4/fx, (y+h)*z4/fy
-
-        # Assumption: We assume that all the points in the hole/gap through which the drone is to pass lie on the same plane(z1,z2,z3 and z4 should be approximately same)
-        gap_width = abs(x2_3d - x1_3d)
-        gap_height = abs(y4_3d - y3_3d)
-        
-        print("The Gap dimensions as width x height are: ",gap_width," x ",gap_height)
-        if gap_width>drone_width and gap_height>drone_height:
-            print("The drone can pass through the gap")
-        else:
-            print("The drone cannot pass through the gap")
-
         cv2.rectangle(near_colored_roi, (x, y), (x + w, y + h), (255, 255, 255), 2)
-
-        # cv2.imshow('Original Color', color_image)
-        cv2.imshow('Depth Image', depth_image)
-        cv2.imshow('Near Masked Image', near_colored)
-        cv2.imshow('Near Masked ROI Image(Result)', near_colored_roi)
-
-        # Break the loop if 'q' is pressed
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-finally:
-    # Stop streaming
-    pipeline.stop()
-    cv2.destroyAllWindows()
+        lap('draw')
+
+        # images['Original Color'] = color_image
+        images = {'Depth Image': depth_image, 'Near Masked Image': near_colored, 'Near Masked ROI Image(Result)': near_colored_roi}
+        return decision, images
+
+
+if __name__ == '__main__':
+    # Configure the frame source(live camera, recorded .bag file or synthetic scenes)
+    parser = add_calibration_arguments(add_metrics_arguments(add_voxel_arguments(add_sweep_arguments(add_decimate_arguments(add_pyramid_arguments(add_decision_arguments(add_pipeline_arguments(add_source_arguments(argparse.ArgumentParser())))))))))
+    args = parser.parse_args()
+    intrinsics = scale_intrinsics(Intrinsics(640, 480, fx, fy, cx, cy), args.width, args.height)
+    source = open_source(args, intrinsics)
+    sink = open_sink(args)
+    metrics, reporter = open_metrics(args)
+    # The detector is built with the intrinsics the stream reports once it is started, the constants above only render the synthetic scenes
+    intrinsics = start_source(source, intrinsics)
+    detector = Detector(intrinsics, pyramid=args.pyramid, decimate=args.decimate, sweep=args.sweep, voxels=args.voxels, calibration=open_calibration(args), timer=metrics)
+
+    # Capture, detection and display run in their own threads, the detection always works on the newest frame(--serial for the old single loop).
+    # In headless mode nothing is drawn or shown, the decisions only go to the sink. With --metrics the stage times, latencies and dropped frames
+    # are served or dumped as text(see instrument.py)
+    try:
+        if args.headless:
+            run(args, source, detector.detect, sink.consume if sink else None, metrics)
+        else:
+            run(args, source, partial(detector.detect, draw=True), make_display(detector.describe, sink), metrics)
+    finally:
+        if sink:
+            sink.close()
+        if reporter:
+            reporter.close()
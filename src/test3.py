@@ -1,15 +1,19 @@
+import argparse
+from functools import partial
 import cv2
 import numpy as np
-import pyrealsense2 as rs
 
-# Configure depth and color streams
-pipeline = rs.pipeline()
-config = rs.config()
-config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
-config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
-
-# Start streaming
-pipeline.start(config)
+from decision import Action, add_decision_arguments, make_decision, open_sink
+from depth_bands import FAR, DepthBandClassifier
+from calibration import add_calibration_arguments, calibrated_size, open_calibration
+from frame_source import Intrinsics, add_source_arguments, open_source, scale_intrinsics, start_source
+from geometry import RayTable, measure_gap, missing_reason
+from instrument import NULL_TIMER, add_metrics_arguments, open_metrics
+from morph import MorphSolver, add_morph_arguments, morph_configs, open_morph
+from pipeline import add_pipeline_arguments, make_display, run
+from pyramid import add_pyramid_arguments, coarse_to_fine
+from scoring import DepthScorer, add_scoring_arguments
+from tracker import GapTracker, add_tracker_arguments
 
 # Camera Intrinsics
 fx, fy, cx, cy = 610, 610, 320, 240
@@ -29,106 +33,248 @@ roi_im_h = image_height - 100  # the height of the ROI
 # Drone's dimensions in image frame assuming that it is present 2m in front of the camera
 drone_im_b = 92  # breadth
 drone_im_h = 46  # height
-
-try:
-    while True:
-        # Wait for a coherent pair of frames
-        frames = pipeline.wait_for_frames()
-        depth_frame = frames.get_depth_frame()
-        color_frame = frames.get_color_frame()
-        color_image = np.asanyarray(color_frame.get_data())
-
-        if not depth_frame or not color_frame:
-            continue
-
-        # Convert depth frame to numpy array
-        depth_image = np.asanyarray(depth_frame.get_data())
-        depth_colormap = cv2.applyColorMap(cv2.convertScaleAbs(depth_image, alpha=0.03), cv2.COLORMAP_HSV)
-
-        # Define near and far thresholds (adjust as needed)
-        far_threshold = 2000 + 100
-        near_threshold = 2000 - 100
-
-        # Coordinates of the ROI rectangle box in the image frame
-        roi_x1, roi_y1 = int(cx - roi_im_b / 2), int(cy - roi_im_h / 2)
-        roi_x2, roi_y2 = int(cx + roi_im_b / 2), int(cy + roi_im_h / 2)
-
-        # Out of the color image, select only the ROI pixels setting the intensity of the rest to 0
-        roi_image = np.zeros_like(color_image)
-        roi_image[roi_y1:roi_y2, roi_x1:roi_x2] = color_image[roi_y1:roi_y2, roi_x1:roi_x2]
-
-        mask_bg = np.where((depth_image > far_threshold), 255, 0).astype(np.uint8)
-        mask_fg = np.where((depth_image < near_threshold), 255, 0).astype(np.uint8)
-        mask_uncertain = np.where((depth_image > near_threshold) & (depth_image < far_threshold), 255, 0).astype(
-            np.uint8)
-
-        # Apply the mask to the grayscale image using mask_bg since we are interested to pass through the gap
-        bg_info_image = cv2.bitwise_and(roi_image, roi_image, mask=mask_bg)
-
-        bg_info_gray = cv2.cvtColor(bg_info_image, cv2.COLOR_BGR2GRAY)
-
-        contours, _ = cv2.findContours(bg_info_gray, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        # Iterate through contours and find the contour with maximum area
-        max_contour = None
-        max_area = 0
-
-        for contour in contours:
-            # Calculate the area of the contour
-            area = cv2.contourArea(contour)
-
-            # Update max_area and max_contour if the current contour has a larger area
-            if area > max_area:
-                max_area = area
-                max_contour = contour
+drone_im_distance = 2.0  # distance(in meters) these dims are given for, where a calibration file is read
+
+# Define near and far thresholds (adjust as needed)
+far_threshold = 2000 + 100
+near_threshold = 2000 - 100
+
+# Tolerances (in pixels of the 640x480 stream)
+tol_to_align_centers = 50  # This tolerance is used to check if the center of the max_area rectangle is aligning with that of ROI
+tol = 50  # This tolerance is used to check if there is any obstacle in front of the drone within 2 m. If that space is clear, the drone can pass through without checking for the remaining conditions for the current frame
+
+# Coordinates of the ROI rectangle box in the image frame
+roi_x1, roi_y1 = int(cx - roi_im_b / 2), int(cy - roi_im_h / 2)
+roi_x2, roi_y2 = int(cx + roi_im_b / 2), int(cy + roi_im_h / 2)
+
+
+# What is printed for every decision
+messages = {
+    Action.FREE_SPACE: "It is a free space ahead! The drone can pass through freely",
+    Action.PASS: "The drone can pass safely without morphing",
+    Action.MORPH: "The drone has to morph",
+    Action.TURN_LEFT: "Try turning the drone towards left to check for a better window to pass through",
+    Action.TURN_RIGHT: "Try turning the drone towards right to check for a better window to pass through",
+    Action.TURN_UP: "Try turning the drone upwards to check for a better window to pass through",
+    Action.TURN_DOWN: "Try turning the drone downwards to check for a better window to pass through",
+}
+
+
+# Finds the contours of a background mask and returns the one with maximum area, None if there is none.
+# offset is added to the points of the contours (e.g. the top-left corner of the ROI).
+# If a scorer is given, the contour with the best depth weighted score (its area weighted by the depth and validity of its bounding rectangle
+# in depth, the depth image the mask was computed from, see scoring.py) is returned instead
+def select_gap(mask, offset=(0, 0), depth=None, scorer=None, metrics=NULL_TIMER):
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+    metrics.observe('contours', len(contours))
+
+    if scorer is not None and depth is not None:
+        if not contours:
+            return None
+        rects = np.array([cv2.boundingRect(contour) for contour in contours]) - (offset[0], offset[1], 0, 0)
+        areas = [cv2.contourArea(contour) for contour in contours]
+        return contours[scorer.best(depth, rects, areas)]
+
+    # Iterate through contours and find the contour with maximum area
+    max_contour = None
+    max_area = 0
+
+    for contour in contours:
+        # Calculate the area of the contour
+        area = cv2.contourArea(contour)
+
+        # Update max_area and max_contour if the current contour has a larger area
+        if area > max_area:
+            max_area = area
+            max_contour = contour
+
+    return max_contour
+
+
+# Binary mask of the background pixels (depth greater than far_threshold) of a depth image
+def background_mask(depth_image):
+    return cv2.compare(depth_image, far_threshold, cv2.CMP_GT)
+
+
+
+class Detector:
+    # The detection logic run on every frame. detect() returns the decision and, if draw is set, the images to show.
+    # pyramid > 1 searches the gap on the ROI decimated by that factor first and refines it at full resolution. track carries the gap forward
+    # between frames and only searches around it until the scene changes, its size and center are smoothed. score picks the contour by its
+    # depth weighted score instead of its area. timer gets a lap at the end of every stage (see instrument.py)
+    # and the number of contours of every mask. morph(True for the default table of configurations, or a table, see morph.py) finds the
+    # smallest morph of the drone fitting each candidate gap. calibration(see calibration.py) replaces drone_im_b/drone_im_h with the
+    # calibrated pixel size of the drone
+    def __init__(self, intrinsics=Intrinsics(image_width, image_height, fx, fy, cx, cy), pyramid=0, track=False, score=False, morph=None, calibration=None, timer=NULL_TIMER):
+        # The pixel dimensions above are given for the 640x480 stream, they are scaled to the resolution actually streamed
+        self.scale = intrinsics.width / image_width
+        self.cx, self.cy = intrinsics.cx, intrinsics.cy
+        self.roi_im_b, self.roi_im_h = roi_im_b * intrinsics.width / image_width, roi_im_h * intrinsics.height / image_height
+        self.drone_im_b, self.drone_im_h = drone_im_b * intrinsics.fx / fx, drone_im_h * intrinsics.fy / fy
+        if calibration is not None:
+            self.drone_im_b, self.drone_im_h = calibrated_size(calibration, drone_im_distance, intrinsics)
+        self.tol_to_align_centers, self.tol = tol_to_align_centers * self.scale, tol * self.scale
+        self.roi = (int(self.cx - self.roi_im_b / 2), int(self.cy - self.roi_im_h / 2), int(self.cx + self.roi_im_b / 2), int(self.cy + self.roi_im_h / 2))
+        self.pyramid = pyramid
+        self.timer = timer
+        self.morph = None
+        if morph is not None and morph is not False:
+            self.morph = MorphSolver(morph_configs(drone_width, drone_height, drone_dim_top_view) if morph is True else morph)
+        self.scorer = DepthScorer() if score else None
+        self.select = partial(select_gap, scorer=self.scorer, metrics=timer)
+
+        # Depth banding of the ROI, its lookup table and label buffer are allocated once
+        self.classifier = DepthBandClassifier(near_threshold, far_threshold, self.roi)
+        self.rays = RayTable(intrinsics)
+        self.tracker = GapTracker(self.search, lambda depth, offset: self.select(background_mask(depth), offset, depth), margin=int(32 * self.scale)) if track else None
+
+    # Full search of the gap in the ROI slice of the depth image, returns its contour in image coordinates(offset by the top-left corner of the ROI)
+    def search(self, depth_roi, offset):
+        if self.pyramid > 1:
+            # Search the gap on the min pooled ROI first and refine only the window around the winner at full resolution
+            return coarse_to_fine(depth_roi, self.pyramid, background_mask, self.select, offset=offset)
+        return self.select(background_mask(depth_roi), offset, depth_roi)
+
+    # What is printed for a decision
+    def describe(self, decision):
+        lines = [(messages[decision.action],)] if decision.action in messages else []
+        if decision.action == Action.MORPH and decision.morph:
+            fit = decision.morph[0]
+            if fit.config >= 0 and fit.amount == 0:
+                lines.append(("The measured gap is big enough for the unmorphed drone",))
+            elif fit.config >= 0:
+                lines.append(("Morph into configuration %d, morph amount %.2f" % (fit.config, fit.amount),))
+            else:
+                lines.append(("No morph configuration fits through the gap",))
+        if decision.reason is not None:
+            lines.append(("The gap could not be measured completely: " + decision.reason,))
+        return lines
+
+    def detect(self, frame, draw=False):
+        lap = self.timer.lap
+        self.timer.begin()
+        color_image = frame.color_image
+        depth_image = frame.depth_image
+        cx, cy = self.cx, self.cy
+        roi_im_b, roi_im_h = self.roi_im_b, self.roi_im_h
+        drone_im_b, drone_im_h = self.drone_im_b, self.drone_im_h
+        roi_x1, roi_y1, roi_x2, roi_y2 = self.roi
+        if self.scorer is not None:
+            self.scorer.depth_scale = frame.depth_scale # the scores are computed in meters
+
+        bands = None
+        if self.tracker is not None:
+            # Search only around the gap of the previous frames unless the scene changed
+            max_contour = self.tracker.update(depth_image[roi_y1:roi_y2, roi_x1:roi_x2], (roi_x1, roi_y1))
+            lap('track')
+        elif self.pyramid > 1:
+            max_contour = self.search(depth_image[roi_y1:roi_y2, roi_x1:roi_x2], (roi_x1, roi_y1))
+            lap('search')
+        else:
+            # Label every ROI pixel as invalid/foreground(depth less than 1.9 meters)/uncertain(between 1.9 and 2.1 meters)/background(depth greater than 2.1 meters) in a single pass over the depth image
+            bands = self.classifier.classify(depth_image)
+            lap('classify')
+
+            # Find the contours of the background since we are interested to pass through the gap. The contours are found within the ROI only and offset back to image coordinates
+            max_contour = self.select(bands.mask(FAR), (roi_x1, roi_y1), depth_image[roi_y1:roi_y2, roi_x1:roi_x2])
+            lap('select')
+
+        decision = make_decision(frame, Action.NO_GAP)
+        images = {}
+        if draw:
+            # Out of the color image, show only the background pixels within the ROI
+            if bands is None:
+                bands = self.classifier.classify(depth_image)
+            bg_info_image = bands.masked_color(color_image)
+            lap('masked_color')
+            images = {'Original Color': color_image, 'Image of interest': bg_info_image}
 
         if max_contour is not None:
             # Get the minimum bounding rectangle of the max_area contour
             rect = cv2.minAreaRect(max_contour)
+            if self.tracker is not None:
+                rect = self.tracker.smooth(rect) # so that the turn/morph commands do not flicker with the noise of the contour
 
             # Extract the rectangle parameters
             (cx_gap_box, cy_gap_box), (w, h), angle = rect
 
-            tol_to_align_centers = 50  # This tolerance is used to check if the center of the max_area rectangle is aligning with that of ROI
-            tol = 50  # This tolerance is used to check if there is any obstacle in front of the drone within 2 m. If that space is clear, the drone can pass through without checking for the remaining conditions for the current frame
+            tol_to_align_centers, tol = self.tol_to_align_centers, self.tol
 
+            action = Action.UNDECIDED
             if abs(w - roi_im_b) < tol and abs(h - roi_im_h) < tol:  # Condition to check if dimensions of max_area rectangle are close to ROI in the current img frame
-                print("It is a free space ahead! The drone can pass through freely")
+                action = Action.FREE_SPACE
 
             elif abs(cx_gap_box - cx) < tol_to_align_centers and abs(cy_gap_box - cy) < tol_to_align_centers:  # centers are aligning
                 if w > drone_im_b and h > drone_im_h:
-                    print("The drone can pass safely without morphing")  # If gap dimensions are more than that of the drone, move forward
+                    action = Action.PASS  # If gap dimensions are more than that of the drone, move forward
                 else:
-                    print("The drone has to morph")  # If gap dimensions are less than that of the drone, morph
+                    action = Action.MORPH  # If gap dimensions are less than that of the drone, morph
 
             elif abs(cx_gap_box - cx) > tol_to_align_centers and abs(cy_gap_box - cy) < tol_to_align_centers:  # x-coordinate of the centers are not aligning
                 if (cx_gap_box - cx) < 0:
-                    print("Try turning the drone towards left to check for a better window to pass through")
+                    action = Action.TURN_LEFT
 
                 elif (cx_gap_box - cx) > 0:
-                    print("Try turning the drone towards right to check for a better window to pass through")
+                    action = Action.TURN_RIGHT
 
             elif abs(cx_gap_box - cx) < tol_to_align_centers and abs(cy_gap_box - cy) > tol_to_align_centers:  # y-coordinate of the centers are not aligning
                 if (cy_gap_box - cy) < 0:
-                    print("Try turning the drone upwards to check for a better window to pass through")
+                    action = Action.TURN_UP
 
                 elif (cy_gap_box - cy) > 0:
-                    print("Try turning the drone downwards to check for a better window to pass through")
-
-            # Draw the minimum bounding rectangle on the image
-            box = cv2.boxPoints(rect)
-            box = np.int0(box)
-            cv2.drawContours(bg_info_image, [box], 0, (0, 255, 0), 2)
-
-        cv2.rectangle(bg_info_image, (roi_x1, roi_y1), (roi_x2, roi_y2), (255, 255, 255), 2)
-        cv2.imshow('Original Color', color_image)
-        cv2.imshow('Image of interest', bg_info_image)
-
-        # Break the loop if 'q' is pressed
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-finally:
-    # Stop streaming
-    pipeline.stop()
-    cv2.destroyAllWindows()
+                    action = Action.TURN_DOWN
+            lap('decide')
+
+            # Size of the gap in meters(measured on its axis aligned bounding box) and the fraction of that box which is really background
+            gap_rect = cv2.boundingRect(max_contour)
+            gap = measure_gap(depth_image, gap_rect, self.rays, frame.depth_scale)
+            lap('measure')
+            x, y, w_rect, h_rect = gap_rect
+            confidence = np.count_nonzero(depth_image[y:y + h_rect, x:x + w_rect] > far_threshold) / (w_rect * h_rect)
+            lap('confidence')
+            morph = None
+            if self.morph is not None:
+                # The candidates come from the background of the whole ROI of this frame, the gap may have been searched in a smaller window
+                mask = bands.mask(FAR) if bands is not None else background_mask(depth_image[roi_y1:roi_y2, roi_x1:roi_x2])
+                morph = self.morph.fit_candidates(depth_image, frame.depth_scale, mask, (roi_x1, roi_y1), gap_rect, gap, self.rays, far_threshold)
+                lap('morph')
+            decision = make_decision(frame, action, gap_rect, (gap.width, gap.height), confidence, morph=morph, reason=missing_reason(gap), plane=(gap.normal, gap.residual))
+
+            if draw:
+                # Draw the minimum bounding rectangle on the image
+                box = cv2.boxPoints(rect)
+                box = box.astype(np.intp)
+                cv2.drawContours(bg_info_image, [box], 0, (0, 255, 0), 2)
+
+        if draw:
+            cv2.rectangle(bg_info_image, (roi_x1, roi_y1), (roi_x2, roi_y2), (255, 255, 255), 2)
+            lap('draw')
+
+        return decision, images
+
+
+if __name__ == '__main__':
+    # Configure the frame source (live camera, recorded .bag file or synthetic scenes)
+    parser = add_calibration_arguments(add_morph_arguments(add_metrics_arguments(add_scoring_arguments(add_tracker_arguments(add_pyramid_arguments(add_decision_arguments(add_pipeline_arguments(add_source_arguments(argparse.ArgumentParser())))))))))
+    args = parser.parse_args()
+    intrinsics = scale_intrinsics(Intrinsics(image_width, image_height, fx, fy, cx, cy), args.width, args.height)
+    source = open_source(args, intrinsics)
+    sink = open_sink(args)
+    metrics, reporter = open_metrics(args)
+    # The detector is built with the intrinsics the stream reports once it is started, the constants above only render the synthetic scenes
+    intrinsics = start_source(source, intrinsics)
+    detector = Detector(intrinsics, pyramid=args.pyramid, track=args.track, score=args.score, morph=open_morph(args), calibration=open_calibration(args), timer=metrics)
+
+    # Capture, detection and display run in their own threads, the detection always works on the newest frame (--serial for the old single loop).
+    # In headless mode nothing is drawn or shown, the decisions only go to the sink. With --metrics the stage times, latencies, dropped frames
+    # and contour counts are served or dumped as text(see instrument.py)
+    try:
+        if args.headless:
+            run(args, source, detector.detect, sink.consume if sink else None, metrics)
+        else:
+            run(args, source, partial(detector.detect, draw=True), make_display(detector.describe, sink), metrics)
+    finally:
+        if sink:
+            sink.close()
+        if reporter:
+            reporter.close()
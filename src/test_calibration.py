@@ -0,0 +1,50 @@
+import numpy as np
+
+from calibration import Calibrator, calibrated_size, load_calibration, save_calibration
+from frame_source import Frame, Intrinsics, scale_intrinsics
+
+intrinsics = Intrinsics(640, 480, 610.0, 610.0, 320.0, 240.0)
+orange = (0, 128, 255) # BGR, within the HSV bounds of find_roi_dims_based_on_color.py
+lower, upper = np.array([0, 100, 100]), np.array([30, 255, 255])
+
+
+# Frame of an orange marker of w x h pixels centered in the image, at distance meters in front of a wall 3 m away
+def marker_frame(w, h, distance):
+    color = np.zeros((480, 640, 3), dtype=np.uint8)
+    depth = np.full((480, 640), 3000, dtype=np.uint16)
+    x, y = 320 - w // 2, 240 - h // 2
+    color[y:y + h, x:x + w] = orange
+    depth[y:y + h, x:x + w] = round(distance * 1000)
+    return Frame(depth, color, 0.0, 0)
+
+
+def calibrate(distances, aw=200.0, bw=10.0, ah=150.0, bh=5.0):
+    calibrator = Calibrator(lower, upper, intrinsics)
+    for distance in distances:
+        rect, _ = calibrator.add(marker_frame(round(aw / distance + bw), round(ah / distance + bh), distance))
+        assert rect is not None
+    return calibrator.fit()
+
+
+def test_fit_recovers_the_marker_size():
+    calibration = calibrate(np.linspace(0.8, 2.5, 12))
+    assert np.allclose(calibration['width'], (200, 10), atol=2)
+    assert np.allclose(calibration['height'], (150, 5), atol=2)
+
+
+def test_fit_needs_two_distances():
+    assert calibrate([1.0]) is None
+
+
+# A detector streaming at the resolution of the calibration gets the fitted size back unchanged from the file, at another one it is scaled by
+# the focal lengths
+def test_calibrated_size_after_loading(tmp_path):
+    calibration = calibrate(np.linspace(0.8, 2.5, 12))
+    path = str(tmp_path / 'calibration.json')
+    save_calibration(path, calibration)
+    loaded = load_calibration(path)
+    (aw, bw), (ah, bh) = calibration['width'], calibration['height']
+    for distance in (0.9, 1.0, 2.0):
+        assert calibrated_size(loaded, distance, intrinsics) == (aw / distance + bw, ah / distance + bh)
+        width, height = calibrated_size(loaded, distance, scale_intrinsics(intrinsics, 1280, 960))
+        assert np.isclose(width, 2 * (aw / distance + bw)) and np.isclose(height, 2 * (ah / distance + bh))
@@ -0,0 +1,88 @@
+import numpy as np
+
+from frame_source import Intrinsics
+from geometry import EDGES, RayTable, group_depth_percentile, measure_gap, measure_gaps
+
+intrinsics = Intrinsics(80, 60, 70.0, 72.0, 39.5, 30.5)
+rays = RayTable(intrinsics)
+scale = 0.001
+
+
+# Bands of pixels just outside rect = (x, y, w, h) in the order of EDGES, clipped to the image
+def bands(depth_image, rect, band):
+    x, y, w, h = rect
+    return (depth_image[y:y + h, max(x - band, 0):max(x, 0)], depth_image[y:y + h, x + w:x + w + band],
+            depth_image[max(y - band, 0):max(y, 0), x:x + w], depth_image[y + h:y + h + band, x:x + w])
+
+
+# measure_gap computed band by band with np.percentile
+def reference(depth_image, rect, band=4, percentile=50):
+    x, y, w, h = rect
+    valid = [values[values > 0] for values in bands(depth_image, rect, band)]
+    left, right, top, bottom = (np.percentile(v, percentile) * scale if v.size else np.nan for v in valid)
+    width = rays.edge_x(x + w - 0.5) * right - rays.edge_x(x - 0.5) * left
+    height = rays.edge_y(y + h - 0.5) * bottom - rays.edge_y(y - 0.5) * top
+    everything = np.concatenate(valid)
+    distance = np.percentile(everything, 50) * scale if everything.size else np.nan
+    missing = tuple(edge for edge, v in zip(EDGES, valid) if v.size == 0)
+    return width if width > 0 else np.nan, height if height > 0 else np.nan, distance, missing
+
+
+def random_depth(seed, invalid=0.3):
+    rng = np.random.default_rng(seed)
+    depth = rng.integers(500, 4000, (intrinsics.height, intrinsics.width)).astype(np.uint16)
+    depth[rng.random(depth.shape) < invalid] = 0
+    return depth
+
+
+def random_rects(count, seed):
+    rng = np.random.default_rng(seed)
+    x, y = rng.integers(0, intrinsics.width - 2, count), rng.integers(0, intrinsics.height - 2, count)
+    return np.stack([x, y, rng.integers(1, intrinsics.width - x), rng.integers(1, intrinsics.height - y)], axis=1)
+
+
+def test_group_depth_percentile_matches_numpy():
+    rng = np.random.default_rng(0)
+    z = rng.integers(1, 65535, 500).astype(np.uint16)
+    group = rng.integers(0, 40, 500)
+    group[group == 7] = 8 # group 7 empty
+    for percentile in (0, 5, 37.5, 50, 100):
+        result = group_depth_percentile(z, group, 41, percentile)
+        expected = [np.percentile(z[group == g], percentile) if (group == g).any() else np.nan for g in range(41)]
+        assert np.allclose(result, expected, equal_nan=True)
+
+
+def test_edges_match_the_band_percentiles():
+    for seed in range(20):
+        depth = random_depth(seed, invalid=(0.3, 0.97)[seed % 2])
+        for rect in random_rects(10, seed):
+            for band, percentile in ((4, 50), (2, 25)):
+                gap = measure_gap(depth, tuple(rect), rays, scale, band, percentile)
+                width, height, distance, missing = reference(depth, rect, band, percentile)
+                assert np.allclose([gap.width, gap.height, gap.distance], [width, height, distance], equal_nan=True), (seed, rect)
+                assert gap.missing == missing
+
+
+def test_batch_matches_single_gaps():
+    depth = random_depth(1)
+    rects = random_rects(30, 1)
+    gaps = measure_gaps(depth, rects, rays, scale)
+    for rect, gap in zip(rects, gaps):
+        single = measure_gap(depth, tuple(rect), rays, scale)
+        assert np.allclose(gap[:3] + (gap.residual,), single[:3] + (single.residual,), equal_nan=True)
+        assert gap.missing == single.missing
+        assert (gap.normal is None) == (single.normal is None)
+        if gap.normal is not None:
+            assert np.allclose(gap.normal, single.normal)
+    assert measure_gaps(depth, np.empty((0, 4), dtype=np.int64), rays, scale) == []
+
+
+def test_plane_of_a_tilted_wall():
+    # Wall z = a*x + b*y + c with a hole in the middle: the point at normalized (u, v) has depth c / (1 - a*u - b*v)
+    a, b, c = 0.3, -0.2, 2.0
+    depth = np.round(c / (1 - a * rays.ray_x - b * rays.ray_y) / scale).astype(np.uint16)
+    depth[20:40, 30:50] = 0
+    gap = measure_gap(depth, (30, 20, 20, 20), rays, scale)
+    assert np.allclose(gap.normal, np.array([a, b, -1]) / np.linalg.norm([a, b, -1]), atol=1e-3)
+    assert gap.residual < 1e-3
+    assert not gap.missing
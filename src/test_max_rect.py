@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from max_rect import largest_empty_rect, largest_empty_rect_decimated, largest_empty_rects, top_k_empty_rects
+
+
+# Largest free rectangle area by trying every rectangle, from the integral image of the blocked pixels
+def brute_force_area(free):
+    H, W = free.shape
+    integral = np.zeros((H + 1, W + 1), dtype=np.int64)
+    integral[1:, 1:] = np.cumsum(np.cumsum(~free, axis=0), axis=1)
+    best = 0
+    for y1 in range(H):
+        for y2 in range(y1 + 1, H + 1):
+            for x1 in range(W):
+                for x2 in range(x1 + 1, W + 1):
+                    if integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1] == 0:
+                        best = max(best, (y2 - y1) * (x2 - x1))
+    return best
+
+
+def is_free(free, rect):
+    x, y, w, h = rect
+    return x >= 0 and y >= 0 and x + w <= free.shape[1] and y + h <= free.shape[0] and free[y:y + h, x:x + w].all()
+
+
+def random_masks(count, shape, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.random(shape) < rng.uniform(0.5, 0.95) for _ in range(count)]
+
+
+def test_largest_empty_rect_is_the_largest():
+    for free in random_masks(200, (7, 9)):
+        rect = largest_empty_rect(free)
+        area = brute_force_area(free)
+        if area == 0:
+            assert rect is None
+        else:
+            assert is_free(free, rect) and rect[2] * rect[3] == area
+
+
+def test_batched_search_matches_single_masks():
+    masks = np.stack(random_masks(24, (6, 8), seed=1)).reshape(2, 3, 4, 6, 8)
+    rects, areas = largest_empty_rects(masks)
+    for index in np.ndindex(masks.shape[:3]):
+        assert areas[index] == brute_force_area(masks[index])
+        assert is_free(masks[index], rects[index]) and rects[index][2] * rects[index][3] == areas[index]
+
+
+def test_top_k_rects_are_free_and_sorted():
+    for free in random_masks(50, (8, 10), seed=2):
+        rects = top_k_empty_rects(free, 5)
+        areas = [w * h for _, _, w, h in rects]
+        assert all(is_free(free, rect) for rect in rects)
+        assert len(set(rects)) == len(rects) and areas == sorted(areas, reverse=True)
+        assert (areas[0] if rects else 0) == brute_force_area(free)
+
+
+@pytest.mark.parametrize('factor', [2, 3, 4])
+def test_decimated_rect_is_free_and_no_larger(factor):
+    for free in random_masks(100, (13, 17), seed=factor):
+        free |= np.random.default_rng(factor).random(free.shape) < 0.8
+        rect = largest_empty_rect_decimated(free, factor, offset=(0, 0))
+        if rect is not None:
+            assert is_free(free, rect) and rect[2] * rect[3] <= brute_force_area(free)
+
+
+def test_decimated_rect_of_a_free_mask_is_the_whole_mask():
+    assert largest_empty_rect_decimated(np.ones((18, 22), dtype=bool), 4, offset=(5, 7)) == (5, 7, 22, 18)
+
+
+def test_decimated_rect_of_a_mask_smaller_than_a_block():
+    assert largest_empty_rect_decimated(np.ones((3, 40), dtype=bool), 4) is None
+    assert largest_empty_rect_decimated(np.ones((40, 3), dtype=bool), 4) is None
@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+import pytest
+
+from frame_source import Intrinsics, SyntheticSource
+from recording import Recorder, Recording
+
+intrinsics = Intrinsics(160, 120, 95.0, 95.0, 80.0, 60.0)
+
+
+# Records num_frames synthetic frames in chunks of chunk_size, returns the frames
+def record(path, num_frames, chunk_size, compress):
+    frames = list(SyntheticSource(intrinsics, num_frames=num_frames, seed=1))
+    recorder = Recorder(str(path), intrinsics, chunk_size=chunk_size, compress=compress)
+    for frame in frames:
+        recorder.write(frame)
+    recorder.close()
+    return frames
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_replay_gives_the_recorded_frames(tmp_path, compress):
+    frames = record(tmp_path, 23, 5, compress)
+    recording = Recording(str(tmp_path))
+    assert len(recording) == 23
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith('index_')) == ['index_%05d.npy' % i for i in range(5)]
+    assert list(recording.index['frame_number']) == [frame.frame_number for frame in frames]
+    for i in (0, 4, 5, 22, -1):
+        assert np.array_equal(recording[i].depth_image, frames[i].depth_image)
+        assert np.array_equal(recording[i].color_image, frames[i].color_image)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_drawing_does_not_change_the_recording(tmp_path, compress):
+    frames = record(tmp_path, 6, 3, compress)
+    recording = Recording(str(tmp_path))
+    recording[1].color_image[:] = 255 # the chunk stays cached
+    with pytest.raises(ValueError):
+        recording[1].depth_image[0, 0] = 0
+    assert np.array_equal(recording[1].color_image, frames[1].color_image)
+    assert np.array_equal(recording[1].depth_image, frames[1].depth_image)
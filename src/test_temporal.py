@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+import pytest
+
+from temporal import TemporalFilter
+
+
+# Median(the lower one of an even number) or minimum of the valid depths of every pixel over the last window frames, 0 if there are none
+def reference(frames, window, mode):
+    stack = np.stack(frames[-window:]).reshape(len(frames[-window:]), -1)
+    result = np.zeros(stack.shape[1], dtype=np.uint16)
+    for p in range(stack.shape[1]):
+        valid = np.sort(stack[stack[:, p] > 0, p])
+        if valid.size:
+            result[p] = valid[(valid.size - 1) // 2] if mode == 'median' else valid[0]
+    return result.reshape(frames[0].shape)
+
+
+def random_frames(count, shape, seed=0):
+    rng = np.random.default_rng(seed)
+    # Few distinct depths so that duplicates are frequent, a third of the pixels invalid
+    return [np.where(rng.random(shape) < 0.33, 0, rng.integers(1, 8, shape) * 500).astype(np.uint16) for _ in range(count)]
+
+
+@pytest.mark.parametrize('mode', ['median', 'min'])
+@pytest.mark.parametrize('window', [1, 2, 3, 5, 8])
+def test_filter_matches_the_window(mode, window):
+    temporal = TemporalFilter(window, mode, fill=0)
+    frames = random_frames(3 * window + 4, (9, 11), seed=window)
+    for i, frame in enumerate(frames):
+        assert np.array_equal(temporal.update(frame), reference(frames[:i + 1], window, mode)), 'frame %d' % i
+
+
+def test_holes_take_the_closest_valid_depth_around():
+    temporal = TemporalFilter(1, 'median', fill=3)
+    frame = random_frames(1, (9, 11), seed=1)[0]
+    filled = temporal.update(frame)
+    padded = cv2.copyMakeBorder(frame, 1, 1, 1, 1, cv2.BORDER_REPLICATE)
+    for y, x in zip(*np.nonzero(frame == 0)):
+        around = padded[y:y + 3, x:x + 3]
+        around = around[around > 0]
+        assert filled[y, x] == (around.min() if around.size else 0)
+    assert np.array_equal(filled[frame > 0], frame[frame > 0])
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from voxmap import VoxelMap, voxel_indices, voxel_keys
+
+
+# Replays the same updates on a dict of voxel index -> (hits, last update seen) and checks the map after every update
+@pytest.mark.parametrize('translation', [None, (0.3, -0.2, 0.5)])
+def test_update_matches_a_dict_of_voxels(translation):
+    rng = np.random.default_rng(0)
+    size, max_range, behind, ttl = 0.1, 3.0, 0.5, 3
+    voxels = VoxelMap(size, max_range=max_range, behind=behind, ttl=ttl, max_voxels=10**9)
+    pose = None
+    if translation is not None:
+        pose = np.eye(4)
+        pose[:3, 3] = translation
+    reference = {}
+    for update in range(1, 30):
+        points = rng.uniform(-3, 3, (rng.integers(0, 400), 3)).astype(np.float32)
+        voxels.update(points, pose)
+
+        # The voxels of the map(refreshed if the frame sees them again) are kept or dropped from the position of their center relative to
+        # the drone and from the last update they were seen in, the voxels the frame adds are always kept
+        points = points[np.einsum('ij,ij->i', points, points) <= max_range**2]
+        if pose is not None:
+            points = points @ pose[:3, :3].T + pose[:3, 3]
+        seen = set(map(tuple, np.floor(points / size).astype(np.int64)))
+        retained = {index: (1, update) for index in seen - set(reference)}
+        for index, (hits, last) in reference.items():
+            if index in seen:
+                hits, last = hits + 1, update
+            center = ((np.array(index) + 0.5) * size).astype(np.float32)
+            if pose is not None:
+                center = (center - pose[:3, 3]) @ pose[:3, :3]
+            if center @ center <= max_range**2 and center[2] >= -behind and update - last < ttl:
+                retained[index] = (hits, last)
+        reference = retained
+
+        assert {tuple(index): (hits, last) for index, hits, last in zip(voxel_indices(voxels.keys), voxels.hits, voxels.seen)} == reference
+        assert (np.diff(voxels.keys) > 0).all()
+        assert np.allclose(voxels.centers, (voxel_indices(voxels.keys) + 0.5) * size)
+
+
+def test_keys_round_trip():
+    indices = np.random.default_rng(1).integers(-2**20, 2**20, (1000, 3))
+    assert np.array_equal(voxel_indices(voxel_keys(indices)), indices)
@@ -0,0 +1,111 @@
+import cv2
+import numpy as np
+
+# Temporal gap tracking: the gap found in the previous frame is carried forward and only a window around it is searched again, the full
+# search is only run when the scene changed materially since the last one. Whether it changed is decided on a subsampled copy of the depth
+# image, so the test costs much less than a search.
+
+
+class GapTracker:
+    # - search(depth, offset) is the full search, it returns the gap(a contour) found in the depth image(the ROI slice) shifted by offset
+    #   or None
+    # - refine(depth, offset) is the same search run on the window around the previous gap
+    # - margin is the number of pixels the previous bounding rectangle is grown by on every side to get the window
+    # - the scene changed when more than change_fraction of the depth samples taken every stride pixels moved by more than change_depth
+    #   (in depth units) since the last full search. A full search is also run every refresh frames
+    # - alpha is the weight of the newest measurement in the smoothing of the gap center and size(1 turns the smoothing off)
+    def __init__(self, search, refine, margin=32, stride=4, change_depth=100, change_fraction=0.05, refresh=30, alpha=0.5):
+        self.search = search
+        self.refine = refine
+        self.margin = margin
+        self.stride = stride
+        self.change_depth = change_depth
+        self.change_fraction = change_fraction
+        self.refresh = refresh
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.reference = None # depth samples taken at the last full search
+        self.rect = None # bounding rectangle (x, y, w, h) of the tracked gap, in the coordinates of the ROI slice
+        self.box = None # smoothed ((cx, cy), (w, h), angle)
+        self.age = 0 # frames since the last full search
+        self.full_searches = 0
+        self.tracked = 0
+
+    # True if the depth image(the ROI slice) differs materially from the one the last full search ran on
+    def changed(self, depth_image):
+        if self.reference is None:
+            return True
+        samples = depth_image[::self.stride, ::self.stride]
+        moved = cv2.compare(cv2.absdiff(samples, self.reference), self.change_depth, cv2.CMP_GT)
+        return cv2.countNonZero(moved) > self.change_fraction * moved.size
+
+    # Returns the gap in the depth image(the ROI slice) shifted by offset, None if there is none
+    def update(self, depth_image, offset=(0, 0)):
+        H, W = depth_image.shape
+        ox, oy = offset
+
+        gap = None
+        tracked = False
+        changed = self.changed(depth_image)
+        if self.rect is not None and self.age < self.refresh and not changed:
+            x, y, w, h = self.rect
+            x1, y1 = max(x - self.margin, 0), max(y - self.margin, 0)
+            x2, y2 = min(x + w + self.margin, W), min(y + h + self.margin, H)
+            gap = self.refine(depth_image[y1:y2, x1:x2], (ox + x1, oy + y1))
+            if gap is not None:
+                gx, gy, gw, gh = cv2.boundingRect(gap)
+                gx, gy = gx - ox, gy - oy
+                # A gap touching a side of the window which is not a side of the ROI may go on beyond the window, search everything again
+                tracked = not ((gx <= x1 and x1 > 0) or (gy <= y1 and y1 > 0) or (gx + gw >= x2 and x2 < W) or (gy + gh >= y2 and y2 < H))
+
+        if tracked:
+            self.age += 1
+            self.tracked += 1
+        else:
+            gap = self.search(depth_image, offset)
+            self.reference = depth_image[::self.stride, ::self.stride].copy()
+            if changed:
+                self.box = None # the smoothing starts over when the scene changed, the gap may have moved anywhere
+            self.age = 0
+            self.full_searches += 1
+
+        if gap is None:
+            self.rect = None
+            return None
+
+        x, y, w, h = cv2.boundingRect(gap)
+        self.rect = (x - ox, y - oy, w, h)
+        return gap
+
+    # Exponentially smoothed minimum area rectangle ((cx, cy), (w, h), angle) of the tracked gap.
+    # A rectangle turned by 90 degrees with its width and height swapped is the same rectangle, so the angle is only defined modulo 90: the
+    # first box is turned within (-45, 45](its width being its side closest to the image x axis) and every later one by the multiple of 90
+    # degrees(swapping width and height for an odd one) that brings it closest to the smoothed one, which averages the angle on that circle.
+    # The smoothed box itself is never turned by an odd multiple of 90 degrees, only kept within (-90, 90] by half turns: its width stays the
+    # same side of the gap on every frame, also when the angle crosses 45 degrees(a box flickering between -44 and 44 degrees is averaged
+    # around 45 degrees instead of 0)
+    def smooth(self, box):
+        (cx, cy), (w, h), angle = box
+        if self.box is None:
+            turns = (45 - angle) // 90
+        else:
+            turns = round((self.box[4] - angle) / 90)
+        angle += 90 * turns
+        if turns % 2:
+            w, h = h, w
+        measured = np.array([cx, cy, w, h, angle], dtype=np.float64)
+
+        if self.box is None:
+            self.box = measured
+        else:
+            self.box = self.alpha * measured + (1 - self.alpha) * self.box
+        self.box[4] += 180 * ((90 - self.box[4]) // 180)
+        cx, cy, w, h, angle = self.box
+        return (cx, cy), (w, h), angle
+
+
+def add_tracker_arguments(parser):
+    parser.add_argument('--track', action='store_true', help='carry the gap forward between frames, search only around it and smooth its size and center(full search when the scene changes)')
+    return parser
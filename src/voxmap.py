@@ -0,0 +1,127 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Sparse voxel occupancy map. Instead of reducing every frame to rectangles in the image, the deprojected depth points are binned into voxels
+# which are kept across frames, so the free space in front of the drone can be checked in 3D whatever the shape of the gap. Only the occupied
+# voxels are stored, as a sorted array of int64 keys(the 3 voxel indices packed, 21 bits each) with per voxel arrays next to it: the voxels
+# of a frame are looked up with one searchsorted, and each array is rebuilt once per frame with the voxels which stay and the new ones merged
+# in a single pass. Memory is bounded by evicting the voxels which are behind the drone, too far from it, not seen for a while or in excess of max_voxels.
+#
+# The map is kept in the frame the points are given in. Without a pose(4x4 camera to world matrix, e.g. from the flight controller) that is
+# the camera frame of the latest frame, and voxels only live for ttl frames: the map is then a short temporal fusion of the last frames,
+# which is still right as long as the drone moves little during ttl frames.
+
+AXIS_BITS = 21
+AXIS_OFFSET = 1 << (AXIS_BITS - 1) # voxel indices from -2^20 to 2^20 - 1, +-52 km with 5 cm voxels
+AXIS_MASK = (1 << AXIS_BITS) - 1
+
+# Result of a corridor query: center (x, y) of the cross-section of the corridor and its length(meters, along +z of the drone), and how far
+# along it the drone can fly before its box meets an occupied voxel(equal to length if the whole corridor is free)
+Corridor = namedtuple('Corridor', ['x', 'y', 'length', 'free'])
+
+
+# (N x 3) int64 voxel indices -> N int64 keys, ordered by z, then y, then x
+def voxel_keys(indices):
+    i = indices + AXIS_OFFSET
+    return (i[:, 2] << (2 * AXIS_BITS)) | (i[:, 1] << AXIS_BITS) | i[:, 0]
+
+
+def voxel_indices(keys):
+    return np.stack([(keys >> (AXIS_BITS * k)) & AXIS_MASK for k in range(3)], axis=-1) - AXIS_OFFSET
+
+
+class VoxelMap:
+    # - voxel_size: edge of a voxel in meters
+    # - max_range: points and voxels further than this from the drone are dropped
+    # - behind: voxels more than this behind the drone(negative z in its frame) are dropped
+    # - ttl: voxels not seen for this many updates are dropped
+    # - min_hits: number of updates a voxel must have been seen in to count as occupied, above 1 single-frame noise is ignored
+    # - max_voxels: the voxels furthest from the drone are dropped beyond this number
+    def __init__(self, voxel_size=0.05, max_range=5.0, behind=0.5, ttl=10, min_hits=1, max_voxels=200000):
+        self.voxel_size = voxel_size
+        self.max_range = max_range
+        self.behind = behind
+        self.ttl = ttl
+        self.min_hits = min_hits
+        self.max_voxels = max_voxels
+        self.keys = np.empty(0, dtype=np.int64)
+        self.centers = np.empty((0, 3), dtype=np.float32) # voxel centers in the map frame
+        self.hits = np.empty(0, dtype=np.int32) # number of updates the voxel was seen in
+        self.seen = np.empty(0, dtype=np.int64) # last update the voxel was seen in
+        self.updates = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    # Coordinates of the voxel centers in the frame of the drone
+    def local(self, pose):
+        if pose is None:
+            return self.centers
+        return (self.centers - pose[:3, 3]) @ pose[:3, :3]
+
+    # Merges the 3D points of a frame(N x 3, meters, camera frame) into the map. pose is the camera to map transform, None for the identity
+    def update(self, points, pose=None):
+        self.updates += 1
+        points = np.compress(np.einsum('ij,ij->i', points, points) <= self.max_range**2, points, axis=0)
+        if pose is not None:
+            points = points @ pose[:3, :3].T + pose[:3, 3]
+        keys = np.sort(voxel_keys(np.floor(points / self.voxel_size).astype(np.int64)))
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])] # unique, several times faster than np.unique on int64 here
+
+        # Voxels already in the map are refreshed in place
+        at = np.searchsorted(self.keys, keys)
+        known = at < len(self.keys)
+        known[known] = self.keys[at[known]] == keys[known]
+        self.hits[at[known]] += 1
+        self.seen[at[known]] = self.updates
+        new, at = keys[~known], at[~known]
+
+        # The voxels which stay and the new ones are merged in one pass over every array: a new voxel goes after the kept voxels whose keys
+        # are smaller, the kept ones fill the other slots in order
+        keep = self.retained(pose)
+        if len(new) or not keep.all():
+            kept = np.flatnonzero(keep)
+            slots = np.searchsorted(kept, at) + np.arange(len(new))
+            others = np.ones(len(kept) + len(new), dtype=bool)
+            others[slots] = False
+            others = np.flatnonzero(others)
+
+            def merge(values, added):
+                merged = np.empty((len(others) + len(slots),) + values.shape[1:], dtype=values.dtype)
+                merged[others] = np.take(values, kept, axis=0) # take is much faster than fancy indexing on the (N, 3) centers
+                merged[slots] = added
+                return merged
+
+            self.keys = merge(self.keys, new)
+            self.centers = merge(self.centers, (voxel_indices(new) + 0.5) * self.voxel_size)
+            self.hits = merge(self.hits, 1)
+            self.seen = merge(self.seen, self.updates)
+
+        # Beyond max_voxels only the voxels closest to the drone are kept
+        if len(self.keys) > self.max_voxels:
+            local = self.local(pose)
+            nearest = np.sort(np.argpartition(np.einsum('ij,ij->i', local, local), self.max_voxels)[:self.max_voxels])
+            self.keys, self.centers, self.hits, self.seen = (np.take(values, nearest, axis=0) for values in (self.keys, self.centers, self.hits, self.seen))
+
+    # Mask of the voxels of the map which stay: within max_range of the drone, not more than behind behind it and seen within ttl updates
+    def retained(self, pose=None):
+        local = self.local(pose)
+        return ((np.einsum('ij,ij->i', local, local) <= self.max_range**2) & (local[:, 2] >= -self.behind)
+                & (self.updates - self.seen < self.ttl))
+
+    # Sweeps the drone's box(width x height cross-section, meters, centered on (x, y) in the frame of the drone) along +z from start to
+    # start + length and returns the Corridor. A voxel blocks the corridor if any part of it can be inside the box
+    def corridor(self, width, height, length, x=0.0, y=0.0, start=0.0, pose=None):
+        local = self.local(pose)
+        half = self.voxel_size / 2
+        blocking = ((self.hits >= self.min_hits) & (np.abs(local[:, 0] - x) <= width / 2 + half) & (np.abs(local[:, 1] - y) <= height / 2 + half)
+                    & (local[:, 2] >= start - half) & (local[:, 2] <= start + length + half))
+        if not blocking.any():
+            return Corridor(x, y, length, length)
+        return Corridor(x, y, length, float(min(max(local[blocking, 2].min() - half - start, 0.0), length)))
+
+
+def add_voxel_arguments(parser):
+    parser.add_argument('--voxels', type=float, default=0, help='also check the corridor of the drone in a voxel map of the last frames, voxels of this size(m), 0 disables it')
+    return parser